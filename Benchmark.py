@@ -0,0 +1,591 @@
+from Scripts import downloader, utils
+import os, sys, re, json, subprocess, threading, time, gzip, argparse, hashlib, zipfile, tempfile, shutil, socket, random, functools
+from io import BytesIO
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows - we just won't report peak RSS
+    resource = None
+
+MiB = 1048576
+PATTERN = bytes(bytearray(range(256)))*4096 # 1MiB of repeating data
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def get_peak_rss():
+    # Returns the peak resident set size of this process in bytes, if known.
+    # Linux carries ru_maxrss over from the parent across fork and exec, so
+    # prefer the high water mark of our own address space where we have it.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])*1024
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return -1
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return peak if sys.platform == "darwin" else peak*1024
+
+def start_server(handler):
+    # Serve the passed handler class on a random local port from a
+    # daemon thread - returns the server so callers can shut it down
+    server = ThreadedServer(("127.0.0.1",0),handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+BUFFER_MODES = ("length","unknown","gzip")
+
+def synthetic_handler(size):
+    # Builds a handler that returns size bytes of synthetic data - /length
+    # sends a Content-Length, /unknown doesn't (so the body runs until the
+    # connection closes) and /gzip sends it gzip compressed
+    data = (PATTERN*(size//len(PATTERN)+1))[:size]
+    # Compress once up front so each request is cheap
+    if hasattr(gzip,"compress"):
+        body = gzip.compress(data)
+    else:
+        out = BytesIO()
+        with gzip.GzipFile(fileobj=out,mode="wb") as f:
+            f.write(data)
+        body = out.getvalue()
+    del data
+    class SyntheticHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        def do_GET(self):
+            mode = self.path.strip("/")
+            self.send_response(200)
+            if mode == "gzip":
+                self.send_header("Content-Length",str(len(body)))
+                self.send_header("Content-Encoding","gzip")
+            elif mode != "unknown":
+                self.send_header("Content-Length",str(size))
+            self.send_header("Connection","close")
+            self.end_headers()
+            if mode == "gzip":
+                self.wfile.write(body)
+                return
+            sent = 0
+            while sent < size:
+                chunk = PATTERN[:min(len(PATTERN),size-sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+    return SyntheticHandler
+
+def legacy_get_bytes(dl, url):
+    # The original Downloader.get_bytes() read loop, which concatenates
+    # onto an immutable bytes object for every chunk
+    response = dl.open_url(url)
+    chunk_so_far = b""
+    copies = copied = 0
+    try:
+        while True:
+            chunk = response.read(dl.chunk)
+            if not chunk: break
+            if chunk_so_far:
+                # Each concatenation re-copies everything read so far
+                copies += 1
+                copied += len(chunk_so_far)
+            chunk_so_far += chunk
+    finally:
+        response.close()
+    if response.headers.get("Content-Encoding","unknown").lower() == "gzip":
+        # Expanded all at once after the whole body is buffered
+        chunk_so_far = gzip.GzipFile(fileobj=BytesIO(chunk_so_far)).read()
+    return (chunk_so_far,copies,copied)
+
+def current_get_bytes(dl, url):
+    # Downloader counts each time get_bytes() has to reallocate its buffer
+    data = dl.get_bytes(url,progress=False)
+    return (data,dl.stats["buffer_copies"],dl.stats["bytes_copied"])
+
+def buffer_worker(impl, url):
+    # Runs a single get_bytes() variant in this process and reports stats
+    dl = downloader.Downloader()
+    func = legacy_get_bytes if impl == "legacy" else current_get_bytes
+    baseline = get_peak_rss()
+    start = time.time()
+    data,copies,copied = func(dl,url)
+    elapsed = time.time()-start
+    peak = get_peak_rss()
+    return {
+        "impl":impl,
+        "bytes":len(data),
+        "seconds":round(elapsed,4),
+        "buffer_copies":copies,
+        "bytes_copied":copied,
+        "peak_rss":peak,
+        # How far past the payload itself the fetch pushed peak RSS
+        "peak_rss_over_payload":peak-baseline-len(data) if peak >= 0 else None
+    }
+
+def bench_buffer(args):
+    # Serves a synthetic response locally and fetches it with the legacy
+    # and current get_bytes() implementations - each in its own process
+    # so peak RSS is measured independently - for each response mode
+    server = start_server(synthetic_handler(args.size*MiB))
+    modes = BUFFER_MODES if args.mode == "all" else (args.mode,)
+    results = []
+    try:
+        for mode in modes:
+            url = "http://127.0.0.1:{}/{}".format(server.server_address[1],mode)
+            runs = {}
+            for impl in ("legacy","current"):
+                p = subprocess.Popen(
+                    [sys.executable,os.path.realpath(__file__),"buffer","--worker",impl,"--url",url],
+                    stdout=subprocess.PIPE
+                )
+                o,e = p.communicate()
+                if p.returncode != 0:
+                    runs[impl] = {"impl":impl,"error":"exited with return code {}".format(p.returncode)}
+                    continue
+                runs[impl] = json.loads(o.decode("utf-8"))
+            result = {"mode":mode,"results":[runs["legacy"],runs["current"]]}
+            peaks = [runs[impl].get("peak_rss",-1) for impl in ("legacy","current")]
+            if all(x > 0 for x in peaks):
+                result["peak_rss_saved"] = peaks[0]-peaks[1]
+            results.append(result)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {"benchmark":"buffer","size_mib":args.size,"results":results}
+
+def legacy_pad_length(var1, var2, pad = "0"):
+    # The original Utils.pad_length()
+    if not type(var1) == type(var2):
+        return (var1, var2)
+    if len(var1) < len(var2):
+        if type(var1) is list:
+            var1.extend([str(pad) for x in range(len(var2) - len(var1))])
+        else:
+            var1 = "{}{}".format((pad*(len(var2)-len(var1))), var1)
+    elif len(var2) < len(var1):
+        if type(var2) is list:
+            var2.extend([str(pad) for x in range(len(var1) - len(var2))])
+        else:
+            var2 = "{}{}".format((pad*(len(var1)-len(var2))), var2)
+    return (var1, var2)
+
+def legacy_compare_versions(vers1, vers2):
+    # The original Utils.compare_versions() - pads and compares each "."
+    # segment as a string on every call
+    vers1 = str(vers1).lower()
+    vers2 = str(vers2).lower()
+    v1_parts, v2_parts = legacy_pad_length(vers1.split("."), vers2.split("."))
+    for i in range(len(v1_parts)):
+        v1 = ''.join(c.lower() for c in v1_parts[i] if c.isalnum())
+        v2 = ''.join(c.lower() for c in v2_parts[i] if c.isalnum())
+        v1, v2 = legacy_pad_length(v1, v2)
+        if str(v1) < str(v2):
+            return True
+        elif str(v1) > str(v2):
+            return False
+    return None
+
+def current_compare_versions(vers1, vers2):
+    key1, key2 = utils.version_key(vers1), utils.version_key(vers2)
+    if key1 == key2:
+        return None
+    return key1 < key2
+
+# Pairs legacy_compare_versions() gets wrong or right by accident - (older, newer)
+VERSION_PAIRS = (
+    ("4.0.0-beta.5","4.0.0"),
+    ("1.0.0-rc.2","1.0.0-rc.10"),
+    ("1.0.0-alpha","1.0.0-alpha.1"),
+    ("1.0.0-beta.11","1.0.0-rc.1"),
+    ("3.7.11","4.0.0"),
+    ("1.9.9","1.10.0"),
+    ("v1.2.3","1.2.4")
+)
+
+def get_tags(count, seed=0):
+    # Returns count unique release-like tags in random order - mostly plain
+    # x.y.z with a share of pre-releases and v prefixes
+    rand = random.Random(seed)
+    tags = set()
+    while len(tags) < count:
+        tag = "{}.{}.{}".format(rand.randint(0,5),rand.randint(0,20),rand.randint(0,30))
+        roll = rand.random()
+        if roll < 0.2:
+            tag += "-{}.{}".format(rand.choice(("alpha","beta","rc")),rand.randint(1,12))
+        elif roll < 0.25:
+            tag = "v"+tag
+        tags.add(tag)
+    tags = sorted(tags)
+    rand.shuffle(tags)
+    return tags
+
+def to_cmp(compare):
+    # compare_versions() style (True/None/False) to a cmp function
+    def cmp(a, b):
+        result = compare(a,b)
+        return -1 if result is True else 0 if result is None else 1
+    return cmp
+
+def bench_versions(args):
+    # Sort a large tag list and answer "newest 4.x" style queries with the
+    # legacy comparison and the cached version keys
+    tags = get_tags(args.tags)
+    prefixes = ["{}.".format(x) for x in range(6)]
+    results = []
+    for impl,compare in (("legacy",legacy_compare_versions),("current",current_compare_versions)):
+        utils._version_keys.clear()
+        sort_key = functools.cmp_to_key(to_cmp(compare))
+        timings = []
+        for run in range(args.runs):
+            start = time.time()
+            ordered = sorted(tags,key=sort_key)
+            timings.append(time.time()-start)
+        start = time.time()
+        for _ in range(args.queries):
+            for prefix in prefixes:
+                newest = None
+                for tag in tags:
+                    if tag.lstrip("v").startswith(prefix) and (newest is None or compare(newest,tag)):
+                        newest = tag
+        query_seconds = time.time()-start
+        results.append({
+            "impl":impl,
+            "sort_seconds_first":round(timings[0],4),
+            "sort_seconds_best":round(min(timings),4),
+            "query_seconds":round(query_seconds,4),
+            "newest":ordered[-1],
+            "correct_pairs":sum(1 for older,newer in VERSION_PAIRS if compare(older,newer) is True),
+            "pairs":len(VERSION_PAIRS)
+        })
+    # How much a plain key sort saves over cmp_to_key on top of the above
+    utils._version_keys.clear()
+    start = time.time()
+    sorted(tags,key=utils.version_key)
+    return {
+        "benchmark":"versions",
+        "tags":len(tags),
+        "runs":args.runs,
+        "queries":args.queries*len(prefixes),
+        "key_sort_seconds":round(time.time()-start,4),
+        "results":results
+    }
+
+# Release layout served by the e2e GitHub stand-in - repo -> (old tag, new tag, asset name template)
+E2E_RELEASES = {
+    "lavalink-devs/Lavalink":("4.0.7","4.0.8","Lavalink.jar"),
+    "lavalink-devs/youtube-source":("1.0.0","1.1.0","youtube-plugin-{}.jar")
+}
+# Stands in for java - answers --version from the jar's version.properties,
+# and otherwise serves the port from application.yml until the first
+# /version request comes in, so readiness probes have something to hit
+FAKE_JAVA = r"""#!{python}
+import sys, re, os, zipfile
+if "-version" in sys.argv:
+    sys.stderr.write('openjdk version "21.0.2"\n')
+    sys.exit(0)
+jar = sys.argv[sys.argv.index("-jar")+1]
+with zipfile.ZipFile(jar) as z:
+    version = z.read("BOOT-INF/classes/version.properties").decode().split("=",1)[1].strip()
+if "--version" in sys.argv:
+    print("Version: "+version)
+    sys.exit(0)
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+with open(os.path.join(os.path.dirname(jar),"application.yml")) as f:
+    port = int(re.search(r"port:\s*(\d+)",f.read()).group(1))
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(version.encode())
+        if self.path == "/version":
+            self.server.done = True
+server = HTTPServer(("127.0.0.1",port),Handler)
+server.done = False
+while not server.done:
+    server.handle_request()
+"""
+
+def build_jar(version, size):
+    # Returns the bytes of a jar Lavalink.py can read the version from,
+    # padded out to roughly size bytes
+    buf = BytesIO()
+    with zipfile.ZipFile(buf,"w",zipfile.ZIP_STORED) as z:
+        z.writestr("BOOT-INF/classes/version.properties","version={}\n".format(version))
+        z.writestr("BOOT-INF/lib/padding.bin",(PATTERN*(size//len(PATTERN)+1))[:size])
+    return buf.getvalue()
+
+def github_handler(assets, latency=0, bandwidth=0):
+    # Builds a handler that mimics the bits of github.com/api.github.com we
+    # use - assets maps repo -> (tag, {asset name: bytes}).  Each request is
+    # delayed by latency seconds and bodies are sent at bandwidth bytes/sec
+    # (0 = unlimited).
+    class GitHubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *args):
+            pass
+        def send(self, code, body=b"", headers=None):
+            self.send_response(code)
+            for k,v in (headers or {}).items():
+                self.send_header(k,v)
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            sent = 0
+            start = time.time()
+            try:
+                while sent < len(body):
+                    chunk = body[sent:sent+65536]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if bandwidth:
+                        # Sleep off however far ahead of the target rate we are
+                        ahead = sent/float(bandwidth)-(time.time()-start)
+                        if ahead > 0: time.sleep(ahead)
+            except (IOError, OSError):
+                # The client hung up early - nothing left to do
+                self.close_connection = True
+        def send_asset(self, data):
+            # Honor single "bytes=start-end" ranges the way GitHub's asset
+            # host does, so segmented downloads get exercised
+            headers = {"Content-Type":"application/octet-stream","Accept-Ranges":"bytes"}
+            match = re.match(r"^bytes=(\d*)-(\d*)$",self.headers.get("Range","").strip())
+            if not match or not any(match.groups()):
+                return self.send(200,data,headers)
+            first,last = match.groups()
+            if not first:
+                # A suffix range - the last N bytes
+                first,last = max(0,len(data)-int(last)),len(data)-1
+            else:
+                first,last = int(first),min(int(last),len(data)-1) if last else len(data)-1
+            if first >= len(data) or first > last:
+                headers["Content-Range"] = "bytes */{}".format(len(data))
+                return self.send(416,b"",headers)
+            headers["Content-Range"] = "bytes {}-{}/{}".format(first,last,len(data))
+            return self.send(206,data[first:last+1],headers)
+        def do_GET(self):
+            if latency: time.sleep(latency)
+            base = "http://{}:{}".format(*self.server.server_address[:2])
+            path = self.path.split("?")[0]
+            for repo,(tag,files) in assets.items():
+                if path in ("/repos/{}/releases/latest".format(repo),"/repos/{}/releases/tags/{}".format(repo,tag)):
+                    body = json.dumps({"tag_name":tag,"assets":[{
+                        "name":name,
+                        "browser_download_url":"{}/{}/releases/download/{}/{}".format(base,repo,tag,name),
+                        "digest":"sha256:"+hashlib.sha256(data).hexdigest()
+                    } for name,data in files.items()]}).encode()
+                    return self.send(200,body,{"Content-Type":"application/json","ETag":'"{}"'.format(hashlib.sha1(body).hexdigest())})
+                if path == "/{}/releases/latest".format(repo):
+                    return self.send(302,headers={"Location":"{}/{}/releases/tag/{}".format(base,repo,tag)})
+                if path == "/{}/releases/tag/{}".format(repo,tag):
+                    return self.send(200,b"<html></html>",{"Content-Type":"text/html"})
+                if path == "/{}/releases/expanded_assets/{}".format(repo,tag):
+                    body = "\n".join('<a href="/{}/releases/download/{}/{}" rel="nofollow">'.format(repo,tag,name) for name in files).encode()
+                    return self.send(200,body,{"Content-Type":"text/html"})
+                for name,data in files.items():
+                    if path == "/{}/releases/download/{}/{}".format(repo,tag,name):
+                        return self.send_asset(data)
+            self.send(404)
+    return GitHubHandler
+
+def get_free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1",0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def e2e_worker(args):
+    # Runs Lavalink.main() against the stand-in server from within the
+    # workspace, recording each stage it reports
+    start = time.time()
+    sys.argv = [sys.argv[0]]
+    import Lavalink
+    imported = time.time()
+    workspace = os.path.realpath(args.workspace)
+    Lavalink.LAVALINK_PATH = os.path.join(workspace,"Lavalink.jar")
+    Lavalink.YML_PATH = os.path.join(workspace,"application.yml")
+    Lavalink.JAVA_PATH = os.path.join(workspace,"bin","java")
+    Lavalink.set_cache_dir(os.path.join(workspace,".cache"))
+    Lavalink.LAVALINK_URL = args.url+"/lavalink-devs/Lavalink/releases/{}"
+    Lavalink.LAVALINK_API = args.url+"/repos/lavalink-devs/Lavalink/releases/{}"
+    Lavalink.PLUGIN_REGISTRY[Lavalink.YTSOURCE_DEP].update({
+        "html":args.url+"/lavalink-devs/youtube-source/releases/{}",
+        "api":args.url+"/repos/lavalink-devs/youtube-source/releases/{}"
+    })
+    Lavalink.u.head = lambda *a,**k: None
+    # Only ever touch the fake Lavalink running from our workspace
+    get_pids = Lavalink.get_pids
+    def workspace_pids(pid=None, include_comm=False):
+        if pid is not None:
+            return get_pids(pid=pid,include_comm=include_comm)
+        pids = [x for x in get_pids(include_comm=True) if workspace in x[0].group("arguments")]
+        return pids if include_comm else [p for c,p in pids]
+    Lavalink.get_pids = workspace_pids
+    spans = []
+    Spans = Lavalink.metrics.Spans
+    def record(*args, **kwargs):
+        # Keep hold of the spans main() records
+        s = Spans(*args,**kwargs)
+        spans.append(s)
+        return s
+    Lavalink.metrics.Spans = record
+    returncode = 0
+    try:
+        Lavalink.main(
+            skip_git=True,
+            prompt_answer="y",
+            prioritize_html=args.html,
+            warm_up=True,
+            show_timings=True,
+            ready_timeout=30,
+            kill_grace=5,
+            segments=args.segments
+        )
+    except SystemExit as e:
+        returncode = e.code or 0
+    end = time.time()
+    return {
+        "returncode":returncode,
+        "import_seconds":round(imported-start,4),
+        "total_seconds":round(end-start,4),
+        "phases":[dict(
+            [("name",name),("seconds",round(e-s,4))]+[(k,round(v,4) if isinstance(v,float) else v) for k,v in attrs.items()]
+        ) for name,s,e,attrs in (spans[0] if spans else [])]
+    }
+
+def bench_e2e(args):
+    # Serve old and new releases from a local GitHub stand-in, start a fake
+    # Lavalink on the old release, then time a full update + restart
+    jar_size = args.jar_size*MiB
+    new_assets = {}
+    old_jars = {}
+    for repo,(old,new,name) in E2E_RELEASES.items():
+        new_assets[repo] = (new,{name.format(new):build_jar(new,jar_size)})
+        old_jars[repo] = (name.format(old),build_jar(old,jar_size))
+    server = start_server(github_handler(new_assets,latency=args.latency/1000.0,bandwidth=args.bandwidth*MiB))
+    url = "http://127.0.0.1:{}".format(server.server_address[1])
+    results = []
+    try:
+        for run in range(args.runs):
+            workspace = tempfile.mkdtemp(prefix="lavalink-e2e-")
+            old = None
+            try:
+                # Lay out the old install
+                os.makedirs(os.path.join(workspace,"bin"))
+                os.makedirs(os.path.join(workspace,"plugins"))
+                java = os.path.join(workspace,"bin","java")
+                with open(java,"w") as f:
+                    f.write(FAKE_JAVA.replace("{python}",os.path.realpath(sys.executable)))
+                os.chmod(java,0o755)
+                name,data = old_jars["lavalink-devs/Lavalink"]
+                with open(os.path.join(workspace,"Lavalink.jar"),"wb") as f:
+                    f.write(data)
+                name,data = old_jars["lavalink-devs/youtube-source"]
+                with open(os.path.join(workspace,"plugins",name),"wb") as f:
+                    f.write(data)
+                with open(os.path.join(workspace,"application.yml"),"w") as f:
+                    f.write("server:\n  port: {}\n  address: 127.0.0.1\nlavalink:\n  plugins:\n    - dependency: \"dev.lavalink.youtube:youtube-plugin:{}\"\n".format(
+                        get_free_port(),E2E_RELEASES["lavalink-devs/youtube-source"][0]
+                    ))
+                # Something for the updater to stop
+                old = subprocess.Popen([java,"-jar",os.path.join(workspace,"Lavalink.jar")],cwd=workspace)
+                time.sleep(0.5)
+                output = os.path.join(workspace,"result.json")
+                with open(os.devnull,"w") as devnull:
+                    p = subprocess.Popen(
+                        [sys.executable,os.path.realpath(__file__),"e2e","--worker","--url",url,"--workspace",workspace,"--output",output,"--segments",str(args.segments)]+(["--html"] if args.html else []),
+                        stdout=None if args.verbose else devnull,
+                        stderr=None if args.verbose else devnull
+                    )
+                    p.communicate()
+                try:
+                    with open(output) as f:
+                        result = json.load(f)
+                except:
+                    result = {"error":"worker exited with return code {}".format(p.returncode)}
+                result["run"] = run+1
+                # Bytes and throughput for the download stage
+                download = [x for x in result.get("phases",[]) if x["name"] == "download"]
+                downloaded = sum(x.get("bytes",0) for x in download)
+                seconds = sum(x["seconds"] for x in download)
+                result["bytes_downloaded"] = downloaded
+                result["download_mib_per_second"] = round(downloaded/float(MiB)/seconds,2) if seconds else None
+                results.append(result)
+            finally:
+                if old and old.poll() is None:
+                    old.kill()
+                    old.wait()
+                shutil.rmtree(workspace,ignore_errors=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        "benchmark":"e2e",
+        "jar_size_mib":args.jar_size,
+        "latency_ms":args.latency,
+        "bandwidth_mib":args.bandwidth,
+        "segments":args.segments,
+        "html":args.html,
+        "results":results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Benchmark.py", description="Benchmark.py - microbenchmarks for the Lavalink-Updater internals")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    buffer_parser = subparsers.add_parser("buffer", help="compare copy count and peak RSS of Downloader.get_bytes() against the legacy implementation")
+    buffer_parser.add_argument("-s", "--size", help="size of the synthetic response in MiB (default is 200)", type=int, default=200)
+    buffer_parser.add_argument("-m", "--mode", help="which responses to fetch - with a Content-Length, without one, gzip compressed, or all of them (default is all)", choices=("all",)+BUFFER_MODES, default="all")
+    buffer_parser.add_argument("--worker", help=argparse.SUPPRESS, choices=["legacy","current"])
+    buffer_parser.add_argument("--url", help=argparse.SUPPRESS)
+    versions_parser = subparsers.add_parser("versions", help="compare sorting and newest-version queries using Utils.compare_versions() against the legacy implementation")
+    versions_parser.add_argument("-t", "--tags", help="how many tags to generate (default is 2000)", type=int, default=2000)
+    versions_parser.add_argument("-r", "--runs", help="how many times to sort the tags (default is 5)", type=int, default=5)
+    versions_parser.add_argument("-q", "--queries", help="how many rounds of newest-version queries to run (default is 20)", type=int, default=20)
+    e2e_parser = subparsers.add_parser("e2e", help="time a full update and restart of a fake Lavalink against a local GitHub stand-in")
+    e2e_parser.add_argument("-s", "--jar-size", help="size of each served jar in MiB (default is 80)", type=int, default=80)
+    e2e_parser.add_argument("-l", "--latency", help="milliseconds of latency added to each request (default is 0)", type=float, default=0)
+    e2e_parser.add_argument("-b", "--bandwidth", help="MiB/s to serve bodies at - 0 is unlimited (default is 0)", type=float, default=0)
+    e2e_parser.add_argument("-r", "--runs", help="how many times to run the update (default is 1)", type=int, default=1)
+    e2e_parser.add_argument("--segments", help="passed through to Lavalink.py --segments (default is 1)", type=int, default=1)
+    e2e_parser.add_argument("--html", help="resolve releases from html before the JSON API", action="store_true")
+    e2e_parser.add_argument("-v", "--verbose", help="show the updater's output", action="store_true")
+    e2e_parser.add_argument("--worker", help=argparse.SUPPRESS, action="store_true")
+    e2e_parser.add_argument("--url", help=argparse.SUPPRESS)
+    e2e_parser.add_argument("--workspace", help=argparse.SUPPRESS)
+    e2e_parser.add_argument("--output", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "buffer":
+        if args.worker:
+            output = buffer_worker(args.worker,args.url)
+        else:
+            output = bench_buffer(args)
+    elif args.benchmark == "versions":
+        output = bench_versions(args)
+    elif args.benchmark == "e2e":
+        if args.worker:
+            result = e2e_worker(args)
+            with open(args.output,"w") as f:
+                json.dump(result,f)
+            exit(0)
+        output = bench_e2e(args)
+    else:
+        parser.print_help()
+        exit(1)
+    print(json.dumps(output,indent=2))
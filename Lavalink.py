@@ -1,10 +1,17 @@
-from Scripts import utils, downloader
-import os, sys, json, subprocess, re, tempfile, shutil, time, datetime, argparse
+import time
+# (label, time) marks for --profile-startup
+STARTUP = [("start",time.time())]
+from Scripts import utils, downloader, store, config, install, readiness, jvm, metrics, releases
+STARTUP.append(("Scripts imports",time.time()))
+import os, sys, json, subprocess, re, tempfile, shutil, datetime, argparse, hashlib, zipfile, threading, signal, select, errno
 
 try:
     from urllib.parse import quote
+    import queue as q
 except ImportError:
     from urllib import quote
+    import Queue as q
+STARTUP.append(("stdlib imports",time.time()))
 
 LAVALINK_URL = "https://github.com/lavalink-devs/Lavalink/releases/{}"
 LAVALINK_API = "https://api.github.com/repos/lavalink-devs/Lavalink/releases/{}"
@@ -12,88 +19,197 @@ LAVALINK_REG = re.compile(r"(?i)^Lavalink\.jar$")
 YTSOURCE_URL = "https://github.com/lavalink-devs/youtube-source/releases/{}"
 YTSOURCE_API = "https://api.github.com/repos/lavalink-devs/youtube-source/releases/{}"
 YTSOURCE_REG = re.compile(r"(?i)^youtube-plugin-([0-9a-z]\.?)+\.jar$")
+YTSOURCE_DEP = ("dev.lavalink.youtube","youtube-plugin")
+
+# Plugins that publish their jars as GitHub release assets - anything not
+# listed here is resolved from its maven repository
+PLUGIN_REGISTRY = {
+    YTSOURCE_DEP: {
+        "name":"YouTube-Source",
+        "html":YTSOURCE_URL,
+        "api":YTSOURCE_API,
+        "regex":YTSOURCE_REG
+    }
+}
+MAVEN_REPO = "https://maven.lavalink.dev/releases"
+MAX_WORKERS = 8 # Max number of concurrent lookups/downloads
 
 DOC_URL = "https://lavalink.dev/configuration/index.html"
 
+KILL_GRACE = 10 # Seconds to wait after asking Lavalink to exit before forcing it
+KILL_TIMEOUT = 5 # Seconds to wait after forcing it before giving up
+WARM_UP_TIMEOUT = 60 # Seconds to allow java -jar Lavalink.jar --version to finish
+DEFAULT_PORT = 2333 # Lavalink's documented server.port
+SUPERVISE_DELAY = 1 # Seconds to wait before the first restart - doubled each time
+SUPERVISE_MAX_DELAY = 60 # Cap on the delay between restarts
+SUPERVISE_MAX_RESTARTS = 5 # Restarts allowed within SUPERVISE_WINDOW before giving up
+SUPERVISE_WINDOW = 600 # Seconds
+ROLLING_READY_TIMEOUT = 120 # Seconds to wait for each instance in a rolling restart, unless --wait-ready is passed
+INSTANCE_LOG = "lavalink.log" # Output of instances started in the background
+LAUNCH_PROFILE = None # Profile to use from launch.json next to application.yml - None uses its default
+RELEASE_INDEX_TTL = 3600 # Seconds to answer version ranges from the release index without asking GitHub
+SELF_UPDATE_TTL = 0 # Seconds to trust the last self update check before asking the remote again
+SELF_UPDATE_WAIT = 10 # Seconds to wait on a self update check that's still running when we exit early
+
 LAVALINK_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),"Lavalink.jar")
 YML_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),"application.yml")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),".cache")
+VERSION_CACHE = os.path.join(CACHE_DIR,"lavalink_versions.json")
+# Records the files swapped in by the last install for --rollback
+INSTALL_MANIFEST = os.path.join(CACHE_DIR,"install.json")
+RELEASE_DIR = os.path.join(CACHE_DIR,"releases")
+STORE = store.ArtifactStore(os.path.join(CACHE_DIR,"store"))
+# Asset url -> digest as reported by the GitHub API
+ASSET_DIGESTS = {}
+# Files within the jar that may hold version info - checked in order
+VERSION_FILES = (
+    "BOOT-INF/classes/version.properties",
+    "version.properties",
+    "BOOT-INF/classes/META-INF/build-info.properties",
+    "META-INF/build-info.properties"
+)
+VERSION_KEYS = ("version","build.version")
 
 u = utils.Utils("Lavalink Updater")
 
 DL = None
-try: DL = downloader.Downloader()
+try: DL = downloader.Downloader(cache_dir=os.path.join(CACHE_DIR,"http"))
 except: pass
+# Located binaries - filled in by get_bin_path()
+BIN_PATHS = {}
 
-PROC_REG = re.compile(r"(?i)^.*(?P<process>javaw?(\.exe)?)(\s*\")?(?P<arguments>(\s.*|\s)+(?P<jar>-jar)\s+.*(?P<lavalink>Lavalink\.jar)\s*\"?)$")
+PROC_REG = re.compile(r"(?i)^.*(?P<process>javaw?(\.exe)?)(\s*\")?(?P<arguments>\s.*(?P<jar>-jar)\s+.*(?P<lavalink>Lavalink\.jar)\s*\"?)$")
 
-def check_yts_version(yml_file):
-    yts_version = None
+def load_yml(yml_file):
+    # Returns the parsed application.yml - shared by all of the helpers
+    # below and only re-read when the file changes
     if not yml_file or not os.path.isfile(yml_file):
-        return yts_version
-    with open(yml_file) as f:
-        yml_data = f.read()
-    for line in yml_data.split("\n"):
-        if not line.strip().startswith("#") and \
-        "- dependency:" in line and \
-        "dev.lavalink.youtube:youtube-plugin:" in line:
-            # We found it - save the version
-            yts_version = line.split("dev.lavalink.youtube:youtube-plugin:")[-1].strip('"')
-            break
-    return yts_version
+        return None
+    try:
+        return config.ApplicationYml.load(yml_file)
+    except:
+        return None
+
+def get_server_info(yml_file):
+    # Returns the (host, port, password) Lavalink will listen on, per the yml
+    yml = load_yml(yml_file)
+    if not yml:
+        return (readiness.probe_host(None),DEFAULT_PORT,None)
+    try:
+        port = int(yml.get("server.port",DEFAULT_PORT))
+    except ValueError:
+        port = DEFAULT_PORT
+    return (
+        readiness.probe_host(yml.get("server.address")),
+        port,
+        yml.get("lavalink.server.password")
+    )
+
+def get_plugins(yml_file):
+    # Returns a list of plugin dicts for each dependency in the yml, noting
+    # where each one's releases come from
+    yml = load_yml(yml_file)
+    if not yml:
+        return []
+    repository = yml.get("lavalink.defaultPluginRepository") or MAVEN_REPO
+    plugins = []
+    for dep in yml.dependencies:
+        entry = PLUGIN_REGISTRY.get((dep["group"],dep["artifact"]),{})
+        plugins.append({
+            "group":dep["group"],
+            "artifact":dep["artifact"],
+            "version":dep["version"],
+            "name":entry.get("name",dep["artifact"]),
+            "snapshot":str(dep.get("snapshot","")).lower() == "true",
+            "repository":dep.get("repository") or repository
+        })
+    return plugins
 
 def check_plugin_dir(yml_file):
-    if not yml_file or not os.path.isfile(yml_file):
+    yml = load_yml(yml_file)
+    if not yml:
         return None
-    with open(yml_file) as f:
-        yml_data = f.read()
-    plugin_dir = None
-    for line in yml_data.split("\n"):
-        if line.lstrip().startswith("pluginsDir: "):
-            # Rip the plugin directory if found
-            plugin_dir = "pluginsDir: ".join(line.lstrip().split("pluginsDir: ")[1:])
-            if plugin_dir[0] == plugin_dir[-1] == '"':
-                # Got quotes
-                plugin_dir = plugin_dir[1:-1]
-            # Get the real path
-            try:
-                cwd = os.getcwd()
-                os.chdir(os.path.dirname(os.path.realpath(__file__)))
-                plugin_dir = os.path.realpath(plugin_dir)
-            except Exception:
-                return None
-            finally:
-                os.chdir(cwd)
-            break
-    # Fall back on the default path of ./plugins
-    return plugin_dir or os.path.join(os.path.dirname(os.path.realpath(__file__)),"plugins")
+    # Falls back on the default path of ./plugins
+    return yml.plugins_dir()
 
-def update_yts_version(yml_file,version,temp):
-    if not yml_file or not os.path.isfile(yml_file):
+def get_plugin_path(plugin_dir,plugin,version=None):
+    # Lavalink expects plugins as pluginsDir/ARTIFACT-VERSION.jar
+    return os.path.join(plugin_dir,"{}-{}.jar".format(plugin["artifact"],version or plugin["version"]))
+
+def update_plugin_versions(yml_file,versions,temp):
+    # Takes a dict of (group, artifact) -> version and writes a single
+    # updated yml to the temp folder
+    yml = load_yml(yml_file)
+    if not yml:
+        return None
+    # Work on a copy so the cached model still matches what's on disk
+    yml = yml.copy()
+    for (group,artifact),version in versions.items():
+        if not yml.set_dependency_version(group,artifact,version):
+            return None
+    return yml.write(os.path.join(temp,os.path.basename(yml_file)))
+
+def load_json(json_file):
+    if not json_file or not os.path.isfile(json_file):
         return None
-    with open(yml_file) as f:
-        yml_data = f.read()
-    new_data = []
-    found = False
-    for line in yml_data.split("\n"):
-        if not line.strip().startswith("#") and \
-        "- dependency:" in line and \
-        "dev.lavalink.youtube:youtube-plugin:" in line:
-            # We found it - save the version
-            yts_version = line.split("dev.lavalink.youtube:youtube-plugin:")[-1].strip('"')
-            line = line.replace(yts_version,version)
-            found = True
-        new_data.append(line)
-    if not found:
+    try:
+        with open(json_file) as f:
+            return json.load(f)
+    except:
         return None
-    temp_yml = os.path.join(temp,os.path.basename(yml_file))
-    with open(temp_yml,"w") as f:
-        f.write("\n".join(new_data))
-    return temp_yml
 
-def check_lavalink_version(lavalink_file):
-    lavalink_version = None
-    if not lavalink_file or not os.path.isfile(lavalink_file):
+def save_json(json_file,json_data):
+    # Swap the new contents into place so readers never see a partially
+    # written file
+    try:
+        utils.atomic_write(json_file,json.dumps(json_data,indent=2))
+    except:
+        return False
+    return True
+
+def get_fingerprint(file_path,include_hash=False):
+    # Returns a dict describing the file as it exists on disk - any change
+    # to the jar (replace, rewrite, touch) will yield a different result
+    if not file_path or not os.path.isfile(file_path):
+        return None
+    try:
+        st = os.stat(file_path)
+        fingerprint = {
+            "path":os.path.realpath(file_path),
+            "size":st.st_size,
+            "mtime":st.st_mtime,
+            "inode":st.st_ino
+        }
+        if include_hash:
+            fingerprint["sha256"] = store.get_sha256(file_path)
+    except:
         return None
+    return fingerprint
+
+def check_jar_version(lavalink_file):
+    # Pull the version straight out of the jar's properties or manifest
+    # without spinning up a JVM
+    try:
+        with zipfile.ZipFile(lavalink_file) as z:
+            names = z.namelist()
+            for name in VERSION_FILES:
+                if not name in names: continue
+                for line in z.read(name).decode("utf-8","ignore").replace("\r","").split("\n"):
+                    if line.strip().startswith("#") or not "=" in line:
+                        continue
+                    key,value = line.split("=",1)
+                    if key.strip() in VERSION_KEYS and value.strip():
+                        return value.strip()
+            if "META-INF/MANIFEST.MF" in names:
+                for line in z.read("META-INF/MANIFEST.MF").decode("utf-8","ignore").replace("\r","").split("\n"):
+                    if line.lower().startswith("implementation-version:"):
+                        version = line.split(":",1)[1].strip()
+                        if version: return version
+    except:
+        pass
+    return None
+
+def check_java_version(lavalink_file):
     if not JAVA_PATH:
         return None
     # Let's try to get the version via java -jar Lavalink.jar --version
@@ -113,13 +229,92 @@ def check_lavalink_version(lavalink_file):
         pass
     return None
 
-def get_latest_info(html, json_api, regex_search, prioritize_html=False):
+def check_lavalink_version(lavalink_file,use_cache=True,include_hash=False):
+    if not lavalink_file or not os.path.isfile(lavalink_file):
+        return None
+    fingerprint = get_fingerprint(lavalink_file,include_hash=include_hash)
+    cache = (load_json(VERSION_CACHE) if use_cache else None) or {}
+    if fingerprint:
+        # Return the cached version if the jar hasn't changed
+        cached = cache.get(fingerprint["path"])
+        if isinstance(cached,dict) and cached.get("fingerprint") == fingerprint and cached.get("version"):
+            return cached["version"]
+    # Check the jar contents first, and only fall back on
+    # launching java if that didn't work
+    lavalink_version = check_jar_version(lavalink_file) or check_java_version(lavalink_file)
+    if lavalink_version and fingerprint and use_cache:
+        cache[fingerprint["path"]] = {
+            "fingerprint":fingerprint,
+            "version":lavalink_version
+        }
+        save_json(VERSION_CACHE,cache)
+    return lavalink_version
+
+def run_concurrently(*calls,**kwargs):
+    # Run each (function, args, kwargs) tuple on a worker thread and return
+    # the results in the order they were passed.  Any call that raises an
+    # exception will report None.  Pass max_workers to bound how many run
+    # at once - by default each call gets its own thread.
+    results = [None]*len(calls)
+    pending = list(enumerate(calls))[::-1]
+    lock = threading.Lock()
+    def worker():
+        while True:
+            with lock:
+                if not pending: return
+                index,call = pending.pop()
+            func = call[0]
+            args = call[1] if len(call) > 1 else ()
+            kw = call[2] if len(call) > 2 else {}
+            try: results[index] = func(*args,**kw)
+            except: pass
+    max_workers = kwargs.get("max_workers") or len(calls)
+    threads = []
+    for _ in range(min(max_workers,len(calls))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        # Join on a timeout so KeyboardInterrupt is still honored
+        while t.is_alive():
+            t.join(0.1)
+    return results
+
+def race_latest_info(comms, regex_search):
+    # Fire off each (function, url) pair at once and return the first
+    # successful result.  Anything still in flight after that is left to
+    # finish on its own daemon thread and its result is discarded.
+    results = q.Queue()
+    def worker(comm,url):
+        try: results.put(comm(url,regex_search))
+        except: results.put((False,None,None))
+    for comm,url in comms:
+        t = threading.Thread(target=worker,args=(comm,url))
+        t.daemon = True
+        t.start()
+    for _ in comms:
+        while True:
+            try:
+                success,version,asset = results.get(timeout=0.1)
+                break
+            except q.Empty:
+                continue
+        if success:
+            return (success,version,asset)
+    return (False,None,None)
+
+def get_latest_info(html, json_api, regex_search, prioritize_html=False, race=False):
     # Prioritize HTML or the JSON API and return the first
     # successful set of results
     comms = ((get_latest_api_info,json_api),(get_latest_html_info,html))
     # Iterate in order if prioritizing the JSON api, otherwise reverse
     # the order
-    for comm,url in comms[::-1 if prioritize_html else 1]:
+    comms = comms[::-1 if prioritize_html else 1]
+    if race:
+        # Query both at once and take whichever answers first
+        return race_latest_info(comms,regex_search)
+    for comm,url in comms:
         success,version,asset = comm(url,regex_search)
         if success:
             # If we succeeded, return the info
@@ -130,7 +325,7 @@ def get_latest_info(html, json_api, regex_search, prioritize_html=False):
 def get_latest_api_info(url, regex_search):
     # Use the GitHub JSON API for gathering our info
     try:
-        json_data = json.loads(DL.get_string(url,progress=False))
+        json_data = json.loads(DL.get_cached_string(url,progress=False))
     except Exception as e:
         json_data = None
     if not json_data:
@@ -143,6 +338,10 @@ def get_latest_api_info(url, regex_search):
         for a in json_data["assets"]:
             if regex_search.match(a.get("browser_download_url","").split("/")[-1]):
                 asset = a["browser_download_url"]
+                # Retain the published digest if any so we can verify the
+                # download later
+                if store.normalize_digest(a.get("digest")):
+                    ASSET_DIGESTS[asset] = a["digest"]
                 break
     except:
         pass
@@ -154,7 +353,14 @@ def get_latest_html_info(url, regex_search):
     if url.lower().endswith("/latest"):
         # Let's rip the latest version just by following URL redirects
         try:
-            url = DL.open_url(url).geturl()
+            response = DL.open_url(url)
+            try:
+                # Drain the body so the connection goes back to the pool
+                while response.read(DL.chunk):
+                    pass
+            finally:
+                response.close()
+            url = response.geturl()
         except:
             return (False,None,None)
     # Now we should have the target URL including the tag.  Let's
@@ -172,7 +378,8 @@ def get_latest_html_info(url, regex_search):
         for line in assets_html.split("\n"):
             if '<a href="' in line:
                 try:
-                    url = "https://github.com"+line.split('<a href="')[1].split('"')[0]
+                    # Asset links are relative to the host serving the html
+                    url = "/".join(assets_url.split("/")[:3])+line.split('<a href="')[1].split('"')[0]
                     if regex_search.match(url.split("/")[-1]):
                         asset = url
                         break
@@ -182,21 +389,195 @@ def get_latest_html_info(url, regex_search):
         pass
     return (version and asset,version,asset)
 
-def get_bin_path(binary):
-    bin_path = None
+def get_maven_info(repository, group, artifact, version=None):
+    # Resolve a plugin from a maven repository - the latest release comes
+    # from maven-metadata.xml, and a pinned version is just a url
+    base = "{}/{}/{}".format(repository.rstrip("/"),group.replace(".","/"),artifact)
+    if not version or releases.is_constraint(version):
+        try:
+            metadata = DL.get_cached_string(base+"/maven-metadata.xml",progress=False)
+            versions = [v for v in re.findall(r"<version>\s*([^<\s]+)\s*</version>",metadata) if not "SNAPSHOT" in v.upper()]
+            if version:
+                # Pick the newest version in range
+                version = releases.newest(versions,version)
+            else:
+                version = re.search(r"<release>\s*([^<\s]+)\s*</release>",metadata)
+                if version:
+                    version = version.group(1)
+                else:
+                    version = versions[-1] if versions else None
+        except:
+            version = None
+    if not version:
+        return (False,None,None)
+    return (True,version,"{}/{}/{}-{}.jar".format(base,version,artifact,version))
+
+def resolve_plugin(plugin, tag=None, prioritize_html=False, race=False):
+    # Resolve the passed plugin from GitHub if it's in our registry, or its
+    # maven repository otherwise
+    source = PLUGIN_REGISTRY.get((plugin["group"],plugin["artifact"]))
+    if not source:
+        return get_maven_info(plugin["repository"],plugin["group"],plugin["artifact"],version=tag)
+    tag = quote(tag) if tag and not releases.is_constraint(tag) else tag
+    return resolve_info(
+        source["html"].format(tag or "latest"),
+        source["api"].format("tags/{}".format(tag) if tag else "latest"),
+        source["regex"],
+        tag=tag,
+        prioritize_html=prioritize_html,
+        race=race
+    )
+
+def get_repo(json_api):
+    # Rip OWNER/REPO from an api.github.com/repos/OWNER/REPO/... url
     try:
-        p = subprocess.Popen(
-            ["where" if os.name == "nt" else "which",binary],
-            stderr=getattr(subprocess,"DEVNULL",open(os.devnull,"w")),
-            stdout=subprocess.PIPE
-        )
-        o,e = p.communicate()
-        assert p.returncode == 0
-        bin_path = o.decode("utf-8").replace("\r","").split("\n")[0]
+        return "/".join(json_api.split("/repos/",1)[1].split("/")[:2])
     except:
-        pass
+        return None
+
+def get_stored_info(json_api, tag, regex_search):
+    # Resolve a pinned tag from our artifact store without touching the
+    # network - returns the same (success, version, asset) tuple as
+    # get_latest_info()
+    repo = get_repo(json_api)
+    if not repo or not tag:
+        return (False,None,None)
+    for key,entry in STORE.find("{}/{}/".format(repo,tag),regex_search):
+        if entry.get("url") and STORE.get(entry.get("digest"),verify=False):
+            return (True,tag,entry["url"])
+    return (False,None,None)
+
+def get_index_info(json_api, constraint, regex_search):
+    # Resolve a version range from the repo's release index - only syncing
+    # with GitHub if the index is stale or has nothing in range.  Returns the
+    # same (success, version, asset) tuple as get_latest_info().
+    repo = get_repo(json_api)
+    if not repo:
+        return (False,None,None)
+    index = releases.ReleaseIndex(
+        os.path.join(RELEASE_DIR,"{}.json".format(repo.replace("/","_"))),
+        json_api.split("/releases/")[0]+"/releases",
+        ttl=RELEASE_INDEX_TTL
+    )
+    for force in (False,True):
+        try:
+            synced = index.sync(lambda url:DL.get_cached_string(url,progress=False),force=force)
+        except:
+            synced = False # Offline - answer from what we have
+        found = index.find(constraint,regex_search)
+        if found:
+            tag,(name,url,digest) = found
+            if store.normalize_digest(digest):
+                ASSET_DIGESTS[url] = digest
+            return (True,tag,url)
+        if synced:
+            # We just checked - a second look won't turn anything up
+            break
+    return (False,None,None)
+
+def resolve_info(html, json_api, regex_search, tag=None, prioritize_html=False, race=False):
+    # Version ranges come from the release index, and pinned tags are
+    # checked against the store first - then fall back on GitHub
+    if tag and releases.is_constraint(tag):
+        try:
+            return get_index_info(json_api,tag,regex_search)
+        except ValueError:
+            return (False,None,None)
+    if tag:
+        success,version,asset = get_stored_info(json_api,tag,regex_search)
+        if success:
+            return (success,version,asset)
+    return get_latest_info(html,json_api,regex_search,prioritize_html=prioritize_html,race=race)
+
+def fetch_asset(url,temp,segments=1,progress=True):
+    # Places the asset at url in the temp folder - hardlinking it from our
+    # artifact store if we've fetched it before, and downloading + verifying
+    # it otherwise.  Returns a tuple of (path, method) where method is
+    # either "download" or however it was linked from the store.
+    target = os.path.join(temp,os.path.basename(url))
+    key = store.asset_key(url)
+    expected = store.normalize_digest(ASSET_DIGESTS.get(url))
+    digest = expected or STORE.lookup(key)
+    if digest and STORE.get(digest):
+        method = STORE.link(digest,target,key=key)
+        if method:
+            return (target,method)
+    hasher = hashlib.sha256()
+    path = DL.stream_to_file(url,target,progress=progress,segments=segments,hasher=hasher)
+    if path is None:
+        raise Exception("Download incomplete")
+    if expected and hasher.hexdigest() != expected:
+        raise Exception("SHA-256 mismatch - expected {}, got {}".format(expected,hasher.hexdigest()))
+    try: STORE.add(path,hasher.hexdigest(),key=key,url=url)
+    except: pass # Not being able to store it shouldn't stop the update
+    return (path,"download")
+
+def parse_size(size):
+    # Turns strings like 500MB, 2GiB or 1048576 into a number of bytes
+    size = str(size).strip().replace(" ","").upper()
+    units = (("TIB",1024**4),("GIB",1024**3),("MIB",1024**2),("KIB",1024),
+             ("TB",1000**4),("GB",1000**3),("MB",1000**2),("KB",1000),("B",1))
+    for unit,mult in units:
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)])*mult)
+    return int(float(size))
+
+def set_cache_dir(cache_dir,max_size=0):
+    # Point all of our caches at cache_dir
+    global CACHE_DIR, VERSION_CACHE, INSTALL_MANIFEST, RELEASE_DIR, STORE
+    CACHE_DIR = os.path.realpath(cache_dir)
+    VERSION_CACHE = os.path.join(CACHE_DIR,"lavalink_versions.json")
+    INSTALL_MANIFEST = os.path.join(CACHE_DIR,"install.json")
+    RELEASE_DIR = os.path.join(CACHE_DIR,"releases")
+    STORE = store.ArtifactStore(os.path.join(CACHE_DIR,"store"),max_size=max_size)
+    if DL and DL.cache:
+        DL.cache.cache_dir = os.path.join(CACHE_DIR,"http")
+
+def fetch_assets(urls,temp,segments=1,progress=True):
+    # Fetch each url via fetch_asset() concurrently - returns a list of
+    # (path, method, error) tuples in the same order
+    def fetch(url):
+        try:
+            return fetch_asset(url,temp,segments=segments,progress=progress)+(None,)
+        except Exception as e:
+            return (None,None,e)
+    return [r or (None,None,None) for r in run_concurrently(
+        *[(fetch,(url,)) for url in urls],
+        max_workers=MAX_WORKERS
+    )]
+
+def get_bin_path(binary):
+    # Search the PATH in-process the way which/where would - results are
+    # cached so each binary is only looked up once
+    if binary in BIN_PATHS:
+        return BIN_PATHS[binary]
+    which = getattr(shutil,"which",None)
+    if which:
+        bin_path = which(binary)
+    else:
+        bin_path = None
+        exts = [""]
+        if os.name == "nt":
+            exts += [x for x in os.environ.get("PATHEXT",".EXE").split(os.pathsep) if x]
+        for folder in os.environ.get("PATH",os.defpath).split(os.pathsep):
+            for ext in exts:
+                path = os.path.join(folder.strip('"'),binary+ext)
+                if os.path.isfile(path) and os.access(path,os.X_OK):
+                    bin_path = path
+                    break
+            if bin_path:
+                break
+    BIN_PATHS[binary] = bin_path
     return bin_path
 
+def print_startup(marks):
+    # Print the time between each of the passed (label, time) marks
+    print("Startup profile:")
+    label_width = max(len(label) for label,t in marks)
+    for (_,last),(label,t) in zip(marks,marks[1:]):
+        print(" - {}: {:.2f}ms".format(label.ljust(label_width),(t-last)*1000))
+    print(" - {}: {:.2f}ms\n".format("total".ljust(label_width),(marks[-1][1]-marks[0][1])*1000))
+
 def cleanup(temp):
     if temp and os.path.exists(temp):
         shutil.rmtree(temp,ignore_errors=True)
@@ -205,10 +586,11 @@ def cleanexit(temp,code=0):
     cleanup(temp)
     exit(code)
 
-def check_pids(prompt_answer=None,temp=None):
+def check_pids(prompt_answer=None,temp=None,kill_grace=None):
     # Gather a list of PIDs for java apps that appear to be running lavalink
     # and ask the user if they want to auto-kill them, ignore, or they can just
     # press enter to refresh the list.
+    kill_grace = KILL_GRACE if kill_grace is None else kill_grace
     if prompt_answer is not None:
         # Make sure it's a valid option - or reset it
         if not prompt_answer in ("y","n","q"):
@@ -248,6 +630,7 @@ def check_pids(prompt_answer=None,temp=None):
             if prompt_answer is None:
                 u.head("Killing Lavalink Processes")
                 print("")
+            active = []
             for c,p in pids:
                 # Check if the PID still corresponds to a running
                 # process
@@ -255,51 +638,161 @@ def check_pids(prompt_answer=None,temp=None):
                 if not get_pids(pid=p):
                     print(" - No longer active")
                     continue
-                print("Killing PID {}...".format(p))
-                returncode = kill_pid(p,temp=temp)
-                if returncode == 0:
-                    print(" - Killed")
-                else:
-                    print(" - Failed with return code {}".format(returncode))
+                active.append(p)
+            if active:
+                # Kill them all at once rather than waiting on each in turn
+                print("Killing PID{} {}...".format("" if len(active) == 1 else "s",", ".join(active)))
+                failed = 0
+                for p,returncode in zip(active,kill_pids(active,temp=temp,grace=kill_grace)):
+                    if returncode == 0:
+                        print(" - {} killed".format(p))
+                    else:
+                        print(" - {} failed with return code {}".format(p,returncode))
+                        failed = failed or returncode
+                if failed:
                     print("")
                     try: u.grab("Press [enter] to exit...")
                     except KeyboardInterrupt: pass
-                    exit(returncode)
+                    exit(failed)
         # If we got here - we're not killing PIDs, or 
         # they should all be dead - return our answer
         # so that we can re-use it as needed
         return (prompt,prompt_answer is None)
 
-def kill_pid(pid,temp=None):
-    timeout = 10 # Allow up to 10 seconds to kill
-    # Automate taskkill or kill based on os
-    comm = ["taskkill","/f","/pid",str(pid),"/t"] if os.name=="nt" else ["kill",str(pid)]
-    p = subprocess.Popen(
-        comm,
-        stderr=getattr(subprocess,"DEVNULL",open(os.devnull,"w")),
-        stdout=getattr(subprocess,"DEVNULL",open(os.devnull,"w"))
-    )
+def wait_pid(pid,timeout):
+    # Wait up to timeout seconds for pid to exit - returns True if it did.
+    # On Linux we block on a pidfd which becomes readable the moment the
+    # process exits, otherwise we fall back on polling with a backoff.
+    pid = int(pid)
+    if hasattr(os,"pidfd_open") and hasattr(select,"poll"):
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            # Either it's already gone, or pidfds aren't supported
+            fd = None
+            if not get_pids(pid=pid):
+                return True
+        if fd is not None:
+            try:
+                poller = select.poll()
+                poller.register(fd,select.POLLIN)
+                return bool(poller.poll(max(0,timeout)*1000))
+            finally:
+                os.close(fd)
+    wait_start = time.time()
+    delay = 0.005
+    while True:
+        try:
+            # Reap it if it happens to be our child
+            if os.waitpid(pid,os.WNOHANG)[0] == pid:
+                return True
+        except:
+            pass
+        if not get_pids(pid=pid):
+            return True
+        remaining = timeout - (time.time() - wait_start)
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay,remaining))
+        delay = min(delay*2,0.25)
+
+def kill_pid(pid,temp=None,grace=KILL_GRACE,timeout=KILL_TIMEOUT):
+    # Ask pid to exit, and force it if it's still running after grace
+    # seconds - then allow up to timeout more seconds for it to go away.
+    # Returns 0 on success, -1 if it outlived us, or the kill error code.
+    if os.name == "nt":
+        # taskkill is already forceful - there's nothing to escalate to
+        signals = ((["taskkill","/f","/pid",str(pid),"/t"],grace+timeout),)
+    else:
+        signals = ((signal.SIGTERM,grace),(signal.SIGKILL,timeout))
     try:
-        p.communicate() # Wait for it to complete
+        for sig,wait in signals:
+            if isinstance(sig,list):
+                p = subprocess.Popen(
+                    sig,
+                    stderr=getattr(subprocess,"DEVNULL",open(os.devnull,"w")),
+                    stdout=getattr(subprocess,"DEVNULL",open(os.devnull,"w"))
+                )
+                p.communicate() # Wait for it to complete
+                if p.returncode != 0:
+                    return p.returncode # Something went wrong killing it
+            else:
+                try:
+                    os.kill(int(pid),sig)
+                except OSError as e:
+                    if e.errno == errno.ESRCH:
+                        return 0 # Already gone
+                    return e.errno or 1
+            if wait_pid(pid,wait):
+                return 0
     except KeyboardInterrupt:
         print("\n - Keyboard interrupt, exiting...\n")
         cleanexit(temp)
-    if p.returncode != 0:
-        return p.returncode # Something went wrong killing it
-    # Verify it closed on a timed loop
-    wait_start = time.time()
-    while True:
-        if not get_pids(pid=pid):
-            break # No longer running
-        if time.time() - wait_start >= timeout:
-            return -1 # We waited too long
-        time.sleep(0.05)
-    return 0
+    return -1 # We waited too long
+
+def kill_pids(pids,temp=None,grace=KILL_GRACE,timeout=KILL_TIMEOUT):
+    # Terminate each of the passed pids in parallel - returns a list of
+    # return codes in the same order
+    try:
+        results = run_concurrently(*[
+            (kill_pid,(p,),{"grace":grace,"timeout":timeout}) for p in pids
+        ])
+    except KeyboardInterrupt:
+        print("\n - Keyboard interrupt, exiting...\n")
+        cleanexit(temp)
+    return [-1 if r is None else r for r in results]
+
+def read_proc(pid,name,mode="r"):
+    # Read /proc/<pid>/<name> - returns None if the process went away or
+    # we aren't allowed to look
+    try:
+        with open(os.path.join("/proc",str(pid),name),mode) as f:
+            return f.read()
+    except:
+        return None
+
+def pid_alive(pid):
+    # Checks /proc/<pid> directly - zombies count as gone
+    stat = read_proc(pid,"stat")
+    if not stat:
+        return False
+    # The state follows the parenthesized command name which may itself
+    # contain spaces or parentheses
+    try: return stat.rsplit(")",1)[1].split()[0] != "Z"
+    except: return True
+
+def get_proc_pids(pid = None, include_comm = False):
+    # Linux-only version of get_pids() that walks /proc instead of running
+    # ps - only java processes have their full command line read
+    if pid is not None:
+        return [str(pid)] if pid_alive(pid) else []
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        comm = read_proc(entry,"comm")
+        if not comm or not comm.strip().lower().startswith("java"):
+            continue
+        cmdline = read_proc(entry,"cmdline","rb")
+        if not cmdline:
+            continue
+        command = " ".join(x.decode("utf-8","ignore") for x in cmdline.split(b"\0") if x)
+        # See if we have java(w)(.exe) -jar Lavalink.jar to
+        # reasonably assume we've found it
+        c = PROC_REG.match(command.strip())
+        if not c: continue
+        pids.append((c,entry) if include_comm else entry)
+    return pids
 
 def get_pids(pid = None, include_comm = False):
     # Helper to extract the PIDs/commands of any instances of java that are
     # running Lavalink.jar - or to optionally check if a particular PID still
     # exists.
+    if USE_PROC:
+        return get_proc_pids(pid=pid,include_comm=include_comm)
+    if pid is not None:
+        # Compared against the text of the ps/wmic output
+        pid = str(pid)
     pids = []
     if os.name == "nt":
         if USE_WMIC:
@@ -344,6 +837,846 @@ def print_line(lines,text):
     lines.append(text)
     return lines
 
+def get_counters():
+    # Running totals that each timed stage reports the change in
+    counters = {"bytes":0,"retries":0,"cache_hits":STORE.stats["hits"]}
+    if DL:
+        counters["bytes"] = DL.stats["bytes"]
+        counters["retries"] = DL.stats["retries"]+(DL.pool.stats["retries"] if DL.pool else 0)
+        if DL.cache:
+            counters["cache_hits"] += DL.cache.stats["hits"]+DL.cache.stats["revalidated"]
+    return counters
+
+def timed(timings,name,start,**kwargs):
+    # Record how long a stage took - returns the time it finished so it can
+    # start the next one
+    end = time.time()
+    if timings is not None:
+        timings.add(name,start,end,**kwargs)
+    return end
+
+def print_timings(lines,timings):
+    if not timings:
+        return lines
+    lines = print_line(lines,"\nStage timings:")
+    name_width = max(len(name) for name,start,end,attrs in timings)
+    for name,start,end,attrs in timings:
+        extra = []
+        if attrs.get("bytes"):
+            extra.append(downloader.get_size(attrs["bytes"]))
+            if attrs.get("throughput"):
+                extra.append("{}/s".format(downloader.get_size(attrs["throughput"])))
+        if attrs.get("cache_hits"):
+            extra.append("{} cache hit{}".format(attrs["cache_hits"],"" if attrs["cache_hits"] == 1 else "s"))
+        if attrs.get("retries"):
+            extra.append("{} retr{}".format(attrs["retries"],"y" if attrs["retries"] == 1 else "ies"))
+        lines = print_line(lines," - {}: {:.3f}s{}".format(
+            name.ljust(name_width),
+            end-start,
+            " ({})".format(", ".join(extra)) if extra else ""
+        ))
+    # Lavalink is unavailable from the moment we start stopping it until
+    # the new process is spawned - or until it answers if we waited
+    outage,ready = metrics.get_outage(timings)
+    if outage is not None:
+        lines = print_line(lines," - {}: {:.3f}s{}".format("outage".ljust(name_width),outage,"" if ready else " (+ JVM start)"))
+    return lines
+
+def report_timings(timings):
+    # Print and/or export the stage timings as requested
+    if not timings:
+        return
+    if timings.show:
+        print_timings([],timings)
+    for path,write in ((timings.json_path,metrics.write_json_lines),(timings.prom_path,metrics.write_prometheus)):
+        if not path:
+            continue
+        try:
+            write(path,timings)
+        except Exception as e:
+            print("\nFailed to write metrics to {}: {}".format(path,e))
+
+def warm_up_jar(jar,timeout=WARM_UP_TIMEOUT):
+    # Run java -jar jar --version to make sure the jar and JVM actually work
+    # before we stop anything.  Returns (success, output).
+    try:
+        p = subprocess.Popen(
+            [JAVA_PATH,"-jar",jar,"--version"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+    except Exception as e:
+        return (False,str(e))
+    output = []
+    t = threading.Thread(target=lambda:output.append(p.communicate()[0]))
+    t.daemon = True
+    t.start()
+    wait_start = time.time()
+    while t.is_alive() and time.time()-wait_start < timeout:
+        t.join(0.1)
+    if t.is_alive():
+        kill_pid(p.pid,grace=0)
+        return (False,"timed out after {}s".format(timeout))
+    output = output[0].decode("utf-8","ignore") if output and output[0] else ""
+    return (p.returncode == 0,output.strip())
+
+def rollback_install(lines,prompt_answer=None,kill_grace=None):
+    # Swap the files from the last install with the ones they replaced
+    lines = print_line(lines,"Rolling back the last install...")
+    if not install.load_manifest(INSTALL_MANIFEST)["files"]:
+        lines = print_line(lines," - Nothing to roll back\n")
+        exit(1)
+    # Running instances may hold the files open - stop them first
+    prompt_answer,printed = check_pids(prompt_answer=prompt_answer,kill_grace=kill_grace)
+    if printed:
+        u.head()
+        print("\n".join(lines))
+    failed = False
+    for dest,error in install.rollback(INSTALL_MANIFEST):
+        if error:
+            failed = True
+            lines = print_line(lines," - {} --> Failed: {}".format(os.path.basename(dest),error))
+        else:
+            lines = print_line(lines," - {}".format(os.path.basename(dest)))
+    if failed:
+        exit(1)
+    return (lines,prompt_answer)
+
+def describe_exit(returncode):
+    # Turn a Popen returncode into something readable
+    if returncode is None:
+        return "exited"
+    if returncode < 0:
+        try:
+            name = signal.Signals(-returncode).name
+        except:
+            name = "signal {}".format(-returncode)
+        return "was killed by {}".format(name)
+    return "exited with code {}".format(returncode)
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return "{}h {}m {}s".format(seconds//3600,seconds%3600//60,seconds%60) if seconds >= 3600 \
+    else "{}m {}s".format(seconds//60,seconds%60) if seconds >= 60 \
+    else "{}s".format(seconds)
+
+def get_launch_command(folder,jar):
+    # Returns java [launch profile options] -jar jar, using the launch.json
+    # in folder if there is one
+    try:
+        profile = jvm.load_profile(folder,LAUNCH_PROFILE)
+    except Exception as e:
+        print(" - Ignoring launch profile: {}".format(e))
+        profile = None
+    return [JAVA_PATH]+jvm.get_args(profile,jar,JAVA_PATH,cds_dir=os.path.join(CACHE_DIR,"cds"))+["-jar",jar]
+
+def start_lavalink(ready_timeout=0,ready_check="http",kill_grace=None):
+    # Spawn Lavalink from our folder and optionally wait for it to become
+    # ready - returns (process, error) where error is set if it never did
+    command = get_launch_command(os.path.dirname(YML_PATH),LAVALINK_PATH)
+    if len(command) > 3:
+        print("JVM options: {}\n".format(" ".join(command[1:-2])))
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    try:
+        lavalink = subprocess.Popen(command)
+    finally:
+        os.chdir(cwd)
+    if not ready_timeout:
+        return (lavalink,None)
+    # Wait for it to start answering on its port before we call it up
+    launched = time.time()
+    host,port,password = get_server_info(YML_PATH)
+    ready,elapsed,detail = readiness.wait_ready(
+        host,
+        port,
+        ready_timeout,
+        path="/version" if ready_check == "http" else None,
+        headers={"Authorization":password} if password else None,
+        is_alive=lambda:lavalink.poll() is None
+    )
+    if not ready:
+        if lavalink.poll() is None:
+            kill_pid(lavalink.pid,grace=KILL_GRACE if kill_grace is None else kill_grace)
+            lavalink.wait()
+        return (lavalink,"did not become ready on {}:{} within {}s: {}".format(host,port,ready_timeout,detail))
+    print("\nLavalink ready on {}:{} after {:.3f}s ({})".format(host,port,elapsed,detail))
+    return (lavalink,None)
+
+def launch_lavalink(lines,prompt_answer=None,kill_grace=None,timings=None,ready_timeout=0,ready_check="http",supervise=False,max_restarts=SUPERVISE_MAX_RESTARTS,restart_window=SUPERVISE_WINDOW,update_check=None):
+    # Kill the running instance if any
+    t = time.time()
+    prompt_answer,printed = check_pids(prompt_answer=prompt_answer,kill_grace=kill_grace)
+    if not timings or not any(x[0] == "stop" for x in timings):
+        t = timed(timings,"stop",t)
+    if printed:
+        # Re-print our prior lines
+        u.head()
+        print("\n".join(lines))
+    restarts = [] # When we've restarted within the window
+    delay = SUPERVISE_DELAY
+    while True:
+        # Start the new version as needed
+        print("\nStarting Lavalink.jar...")
+        if not os.path.isfile(LAVALINK_PATH):
+            print(" - File does not exist!\n")
+            exit(1)
+        print("")
+        t = time.time()
+        started = t
+        try:
+            lavalink,error = start_lavalink(ready_timeout=ready_timeout,ready_check=ready_check,kill_grace=kill_grace)
+            if error is None:
+                if ready_timeout:
+                    timed(timings,"ready",t)
+                elif timings is not None:
+                    timed(timings,"launch",t)
+                if timings:
+                    report_timings(timings)
+                    if timings.show:
+                        print("")
+                # Only report the first launch
+                timings = None
+                lavalink.communicate()
+        except KeyboardInterrupt:
+            print("\n - Keyboard interrupt, exiting...\n")
+            exit()
+        if error:
+            print("\nLavalink {}\n".format(error))
+        if not supervise:
+            if error:
+                exit(1)
+            try:
+                exit(lavalink.returncode)
+            except:
+                # We couldn't get the return code - the process
+                # was likely killed - so exit with a 0 status
+                exit(0)
+        uptime = time.time()-started
+        if not error:
+            print("\n{}: Lavalink {} after running for {}".format(
+                datetime.datetime.now().time().isoformat(),
+                describe_exit(lavalink.returncode),
+                format_seconds(uptime)
+            ))
+            if lavalink.returncode == 0:
+                # A clean exit was asked for - don't fight it
+                print(" - Clean exit, no longer supervising\n")
+                exit(0)
+        # Only count restarts within the window, and reset the backoff if it
+        # stayed up for a whole window
+        now = time.time()
+        restarts = [x for x in restarts if now-x < restart_window]
+        if uptime >= restart_window:
+            delay = SUPERVISE_DELAY
+        if len(restarts) >= max_restarts:
+            print(" - Restarted {} time{} in the last {}, giving up\n".format(
+                len(restarts),
+                "" if len(restarts) == 1 else "s",
+                format_seconds(restart_window)
+            ))
+            exit(lavalink.returncode if lavalink.returncode and lavalink.returncode > 0 else 1)
+        print(" - Restarting in {}...".format(format_seconds(delay) if delay >= 1 else "{:.1f}s".format(delay)))
+        try:
+            time.sleep(delay)
+        except KeyboardInterrupt:
+            print("\n - Keyboard interrupt, exiting...\n")
+            exit()
+        delay = min(delay*2,SUPERVISE_MAX_DELAY)
+        restarts.append(time.time())
+        if update_check:
+            # Pick up any updates while it's down anyway
+            update_check()
+
+def check_for_updates(settings):
+    # Re-run the update flow in-process between supervised restarts - only
+    # updating, and never prompting as our own instance is already down.
+    # Metrics aren't exported so the check doesn't overwrite the run that
+    # started the supervisor.
+    print("\nChecking for updates before restarting...")
+    try:
+        main(**dict(
+            settings,
+            skip_git=True,
+            list_update=False,
+            only_update=True,
+            rollback=False,
+            supervise=False,
+            header=False,
+            prompt_answer="n",
+            profile_startup=False,
+            metrics_json=None,
+            metrics_prom=None
+        ))
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(" - Update check failed: {}".format(e))
+
+def get_instance_manifest(folder):
+    # Each instance keeps its own install manifest so they roll back separately
+    key = hashlib.sha1(os.path.realpath(folder).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_DIR,"instances","{}.json".format(key))
+
+def get_instance_pids(folder):
+    # PIDs of Lavalink running from folder - matched by the jar path on the
+    # command line, or by the working directory on Linux
+    folder = os.path.realpath(folder)
+    jar = os.path.join(folder,"Lavalink.jar")
+    pids = []
+    for c,p in get_pids(include_comm=True):
+        args = c.group("arguments")
+        if jar in args:
+            pids.append(p)
+            continue
+        if not USE_PROC or re.search(r"[\\/]Lavalink\.jar",args):
+            continue
+        try:
+            cwd = os.path.realpath(os.readlink(os.path.join("/proc",p,"cwd")))
+        except:
+            continue
+        if cwd == folder:
+            pids.append(p)
+    return pids
+
+def start_instance(folder):
+    # Start Lavalink from folder in the background so it outlives us - its
+    # output is appended to folder/lavalink.log
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = 0x00000008|0x00000200 # DETACHED_PROCESS|CREATE_NEW_PROCESS_GROUP
+    elif sys.version_info >= (3,2):
+        # Forks safely while other threads are running
+        kwargs["start_new_session"] = True
+    elif hasattr(os,"setsid"):
+        kwargs["preexec_fn"] = os.setsid
+    with open(os.path.join(folder,INSTANCE_LOG),"ab") as log, open(os.devnull,"rb") as devnull:
+        return subprocess.Popen(
+            get_launch_command(folder,os.path.join(folder,"Lavalink.jar")),
+            cwd=folder,
+            stdin=getattr(subprocess,"DEVNULL",devnull),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            **kwargs
+        )
+
+def wait_instance(instance,lavalink,timeout,ready_check="http"):
+    host,port,password = get_server_info(instance["yml"])
+    ready,elapsed,detail = readiness.wait_ready(
+        host,
+        port,
+        timeout,
+        path="/version" if ready_check == "http" else None,
+        headers={"Authorization":password} if password else None,
+        is_alive=lambda:lavalink.poll() is None
+    )
+    if ready:
+        return (True,"ready on {}:{} after {:.3f}s".format(host,port,elapsed))
+    return (False,"did not become ready on {}:{} within {}s: {}".format(host,port,timeout,detail))
+
+def roll_instance(instance,restart=True,ready_timeout=ROLLING_READY_TIMEOUT,ready_check="http",kill_grace=None):
+    # Stop an instance, swap in its staged files (or roll them back) and
+    # start it again - returns (success, message)
+    kill_grace = KILL_GRACE if kill_grace is None else kill_grace
+    pids = get_instance_pids(instance["folder"])
+    if pids and any(r != 0 for r in kill_pids(pids,grace=kill_grace)):
+        return (False,"could not stop PID{} {}".format("" if len(pids) == 1 else "s",", ".join(pids)))
+    manifest = get_instance_manifest(instance["folder"])
+    changed = False
+    if instance.get("rollback"):
+        results = install.rollback(manifest) or []
+        errors = [str(e) for d,e in results if e]
+        if errors:
+            return (False,"failed to roll back: {}".format(", ".join(errors)))
+        changed = bool(results)
+    elif instance.get("staged"):
+        try:
+            instance["staged"].activate()
+        except Exception as e:
+            return (False,"failed to move files, restored the previous install: {}".format(e))
+        changed = True
+    if not restart:
+        return (True,"updated" if changed else "nothing to do")
+    lavalink = start_instance(instance["folder"])
+    success,message = wait_instance(instance,lavalink,ready_timeout,ready_check=ready_check)
+    if success or not changed:
+        return (success,message)
+    # The new files didn't come up - put the old ones back
+    if lavalink.poll() is None:
+        kill_pid(lavalink.pid,grace=kill_grace)
+        lavalink.wait()
+    install.rollback(manifest)
+    lavalink = start_instance(instance["folder"])
+    restored,restored_message = wait_instance(instance,lavalink,ready_timeout,ready_check=ready_check)
+    return (False,"{} - rolled back, {}".format(message,restored_message))
+
+def get_targets(l_target,y_target,plugin_targets):
+    # Returns (l_target, l_api_target, plugin_targets).  Exact tags are
+    # quoted, and the GitHub API expects
+    # api.github.com/repos/OWNER/REPO/releases/tags/TAG if not latest -
+    # version ranges are resolved locally instead.
+    plugin_targets = dict(plugin_targets or {})
+    if y_target:
+        plugin_targets.setdefault(YTSOURCE_DEP[1],y_target)
+    l_api_target = None
+    if l_target and not releases.is_constraint(l_target):
+        l_target = quote(l_target)
+        l_api_target = "tags/{}".format(l_target)
+    return (l_target,l_api_target,plugin_targets)
+
+def plugin_key(plugin,tag):
+    # Plugins from the same source and tag only need resolving once
+    return (plugin["group"],plugin["artifact"],plugin["repository"],tag)
+
+def resolve_remote(lines,plugins,l_target,l_api_target,plugin_targets,cache_ttl=0,prioritize_html=False,race=False):
+    # Resolve Lavalink and every unique plugin at the same time - returns
+    # (lines, (success, version, url) for Lavalink, and plugin_key() -> the
+    # same for each plugin)
+    wanted = {}
+    for plugin in plugins:
+        wanted.setdefault(plugin_key(plugin,plugin_targets.get(plugin["artifact"])),plugin)
+    keys = list(wanted)
+    lines = print_line(lines,"Remote versions:")
+    if DL.cache:
+        DL.cache.ttl = cache_ttl
+    resolve_kwargs = {"prioritize_html":prioritize_html,"race":race}
+    resolved = run_concurrently(
+        (resolve_info,(
+            LAVALINK_URL.format(l_target or "latest"),
+            LAVALINK_API.format(l_api_target or "latest"),
+            LAVALINK_REG
+        ),dict(resolve_kwargs,tag=l_target)),
+        *[(resolve_plugin,(wanted[k],),dict(resolve_kwargs,tag=k[3])) for k in keys],
+        max_workers=MAX_WORKERS
+    )
+    lavalink = resolved[0] or (False,None,None)
+    remote = dict(zip(keys,[r or (False,None,None) for r in resolved[1:]]))
+    lines = print_line(lines," - Lavalink: {}".format(lavalink[1] if lavalink[0] else "Error checking for updates"))
+    for key in keys:
+        success,version,url = remote[key]
+        lines = print_line(lines," - {}: {}".format(wanted[key]["name"],version if success else "Error checking for updates"))
+    return (lines,lavalink,remote)
+
+def get_plugin_download(plugin,plugin_dir,info):
+    success,version,url = info
+    return (plugin["name"],url,version,get_plugin_path(plugin_dir,plugin,version),plugin)
+
+def plan_downloads(jar,jar_version,plugins,plugin_dir,lavalink,remote,plugin_targets,force=False,update=True,force_if_different=False):
+    # Work out what one Lavalink folder needs.  Updates are required if the
+    # current file does not exist, if we're forcing updates, or if our
+    # version number means we need one - any difference counts when forcing
+    # if different.  Returns (downloads, missing) where each download is a
+    # tuple of (name, url, version, destination, plugin), and missing lists
+    # the plugins we're not updating whose declared file isn't there.
+    allowed_comparisons = (True,False) if force_if_different else (True,)
+    downloads = []
+    missing = []
+    l_success,l_version,l_url = lavalink
+    if force or jar_version is None or (update and u.compare_versions(jar_version,l_version) in allowed_comparisons):
+        downloads.append(("Lavalink",l_url,l_version,jar,None))
+    for plugin in plugins:
+        info = remote[plugin_key(plugin,plugin_targets.get(plugin["artifact"]))]
+        if force or (update and u.compare_versions(plugin["version"],info[1]) in allowed_comparisons):
+            downloads.append(get_plugin_download(plugin,plugin_dir,info))
+        elif not os.path.isfile(get_plugin_path(plugin_dir,plugin)):
+            missing.append(plugin)
+    return (downloads,missing)
+
+def resolve_missing(plugins,prioritize_html=False,race=False):
+    # Look up the declared version of each plugin whose file is missing -
+    # returns plugin_key() -> (success, version, url)
+    wanted = {}
+    for plugin in plugins:
+        wanted.setdefault(plugin_key(plugin,plugin["version"]),plugin)
+    keys = list(wanted)
+    return dict(zip(keys,[r or (False,None,None) for r in run_concurrently(
+        *[(resolve_plugin,(wanted[k],),{"tag":k[3],"prioritize_html":prioritize_html,"race":race}) for k in keys],
+        max_workers=MAX_WORKERS
+    )]))
+
+def get_download_urls(downloads):
+    # Each unique url in downloads, in order
+    urls = []
+    for name,url,version,dest,plugin in downloads:
+        if url and not url in urls:
+            urls.append(url)
+    return urls
+
+def fetch_downloads(lines,downloads,segments=1):
+    # Download each unique url just once - into a temp dir under our cache
+    # folder so it's likely on the same filesystem as the store and the
+    # install, and can be linked rather than copied.  Returns (lines, temp,
+    # url -> (path, method, error)).
+    urls = get_download_urls(downloads)
+    if not urls:
+        return (lines,None,{})
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    temp = tempfile.mkdtemp(dir=CACHE_DIR)
+    # Only draw a progress bar if there's a single download
+    fetched = dict(zip(urls,fetch_assets(urls,temp,segments=segments,progress=len(urls)==1)))
+    names = dict((url,name) for name,url,version,dest,plugin in reversed(downloads))
+    for url in urls:
+        path,method,error = fetched[url]
+        if error or not path:
+            lines = print_line(lines," - {}: Failed to download: {}".format(names[url],error))
+        elif method != "download":
+            lines = print_line(lines," - {}: Found in local store ({})".format(names[url],method))
+    return (lines,temp,fetched)
+
+def get_fetched_jar(downloads,fetched):
+    # Path to the Lavalink.jar we downloaded, if any
+    return next((fetched[url][0] for name,url,version,dest,plugin in downloads if not plugin and url in fetched),None)
+
+def get_install_files(downloads,fetched,yml,temp):
+    # Pairs each fetched download with its destination as (source,
+    # destination, version) - along with a copy of yml written to temp that
+    # expects the new plugin versions.  Returns None if the yml couldn't be
+    # updated, as the new plugin files would be useless without it.
+    files = []
+    versions = {}
+    for name,url,version,dest,plugin in downloads:
+        path,method,error = fetched.get(url,(None,None,None))
+        if error or not path:
+            continue
+        files.append((path,dest,version))
+        if plugin and version != plugin["version"]:
+            versions[(plugin["group"],plugin["artifact"])] = version
+    if versions:
+        # Update the yml to expect the new versions in a single pass
+        yml_temp = update_plugin_versions(yml,versions,temp)
+        if yml_temp is None:
+            return None
+        files.append((yml_temp,yml,None))
+    return files
+
+def stage_files(manifest,files):
+    # Stage every (source, destination, version) next to its destination
+    # while Lavalink is still running so swapping them in later is just a
+    # rename per file - nothing is left staged if any of them fail
+    staged = install.StagedInstall(manifest)
+    try:
+        for src,dest,version in files:
+            staged.stage(src,dest)
+    except:
+        staged.discard()
+        raise
+    return staged
+
+def verify_jar(lines,jar):
+    # Make sure the new jar runs before we take the old one down - returns
+    # (lines, success)
+    lines = print_line(lines,"\nVerifying the new Lavalink.jar...")
+    success,output = warm_up_jar(jar)
+    version = next((x for x in output.split("\n") if "version" in x.lower()),output.split("\n")[-1])
+    if not success:
+        lines = print_line(lines," --> Failed: {}".format(version or "no output"))
+        return (lines,False)
+    lines = print_line(lines," - {}".format(version.strip() or "OK"))
+    return (lines,True)
+
+def check_launch_profile(folder):
+    # Bail early if the requested launch profile can't be used
+    try:
+        jvm.load_profile(folder,LAUNCH_PROFILE)
+    except Exception as e:
+        print("Could not load launch profile: {}\n".format(e))
+        exit(1)
+
+def update_instances(folders,settings,timings=None):
+    # Update several Lavalink folders in one pass.  Each release is resolved
+    # and downloaded once, then linked into every folder that needs it, and
+    # the instances are restarted batch_size at a time - each batch must be
+    # ready before the next one is taken down.
+    lines = []
+    instances = []
+    for folder in folders:
+        folder = os.path.realpath(folder)
+        yml = os.path.join(folder,"application.yml")
+        if not os.path.isfile(yml):
+            print("{} not found!\n".format(yml))
+            print("Please visit the following link to create one:")
+            print(" - {}\n".format(DOC_URL))
+            exit(1)
+        check_launch_profile(folder)
+        instances.append({
+            "folder":folder,
+            "yml":yml,
+            "jar":os.path.join(folder,"Lavalink.jar"),
+            "plugin_dir":check_plugin_dir(yml),
+            # Snapshot builds don't have stable jar names - leave those to Lavalink
+            "plugins":[p for p in get_plugins(yml) if not p["snapshot"]],
+            "staged":None,
+            "rollback":settings["rollback"]
+        })
+    restart = not settings["only_update"]
+    batch_size = max(1,settings["batch_size"] or 1)
+    ready_timeout = settings["ready_timeout"] or ROLLING_READY_TIMEOUT
+    if settings["rollback"]:
+        # Roll each instance back to its previous install, a batch at a time
+        return roll_instances(lines,instances,restart,batch_size,ready_timeout,settings,timings)
+    t = time.time()
+    lines = print_line(lines,"Local versions:")
+    for instance in instances:
+        instance["version"] = check_lavalink_version(instance["jar"],include_hash=settings["hash_jar"])
+        lines = print_line(lines," - {}".format(instance["folder"]))
+        lines = print_line(lines," --> Lavalink: {}".format(instance["version"] or "MISSING"))
+        for plugin in instance["plugins"]:
+            lines = print_line(lines," --> {}: {}{}".format(
+                plugin["name"],
+                plugin["version"],
+                "" if os.path.isfile(get_plugin_path(instance["plugin_dir"],plugin)) else " - FILE MISSING"
+            ))
+    t = timed(timings,"local",t)
+    l_target,l_api_target,plugin_targets = get_targets(settings["l_target"],settings["y_target"],settings["plugin_targets"])
+    resolve_kwargs = {"prioritize_html":settings["prioritize_html"],"race":settings["race"]}
+    lines,lavalink,remote = resolve_remote(
+        lines,
+        [p for instance in instances for p in instance["plugins"]],
+        l_target,
+        l_api_target,
+        plugin_targets,
+        cache_ttl=settings["cache_ttl"],
+        **resolve_kwargs
+    )
+    # Work out what each instance needs
+    for instance in instances:
+        instance["downloads"],instance["missing"] = plan_downloads(
+            instance["jar"],
+            instance["version"],
+            instance["plugins"],
+            instance["plugin_dir"],
+            lavalink,
+            remote,
+            plugin_targets,
+            force=settings["force"],
+            update=settings["only_update"] or settings["update"],
+            force_if_different=settings["force_if_different"]
+        )
+    if settings["list_update"]:
+        lines = print_line(lines,"")
+        for instance in instances:
+            names = [name for name,url,version,dest,plugin in instance["downloads"] if version]
+            lines = print_line(lines,"{}: {}".format(
+                instance["folder"],
+                "{} update{} available".format(", ".join(names),"" if len(names) == 1 else "s") if names else "up to date"
+            ))
+        exit()
+    found = resolve_missing([p for instance in instances for p in instance["missing"]],**resolve_kwargs)
+    for instance in instances:
+        for plugin in instance["missing"]:
+            instance["downloads"].append(get_plugin_download(plugin,instance["plugin_dir"],found[plugin_key(plugin,plugin["version"])]))
+    t = timed(timings,"resolve",t)
+    # Each release is downloaded once and linked into every folder
+    downloads = [d for instance in instances for d in instance["downloads"]]
+    urls = get_download_urls(downloads)
+    if urls:
+        lines = print_line(lines,"\nDownloading {} file{}...".format(len(urls),"" if len(urls) == 1 else "s"))
+        for url in urls:
+            lines = print_line(lines," - {}".format(os.path.basename(url)))
+    lines,temp,fetched = fetch_downloads(lines,downloads,segments=settings["segments"])
+    t = timed(timings,"download",t)
+    jar = get_fetched_jar(downloads,fetched)
+    if settings["warm_up"] and jar:
+        # Every instance gets the same jar - so it only needs checking once
+        lines,success = verify_jar(lines,jar)
+        if not success:
+            lines = print_line(lines," --> Leaving every instance untouched\n")
+            cleanup(temp)
+            timed(timings,"verify",t,failed=True)
+            report_timings(timings)
+            exit(1)
+        t = timed(timings,"verify",t)
+    # Stage every instance's files before anything is stopped
+    for index,instance in enumerate(instances):
+        yml_temp = None
+        if temp:
+            # Each instance gets its own copy of the yml
+            yml_temp = os.path.join(temp,str(index))
+            os.makedirs(yml_temp)
+        files = get_install_files(instance["downloads"],fetched,instance["yml"],yml_temp)
+        if files is None:
+            lines = print_line(lines," - {}: Failed to update {}, leaving it untouched".format(instance["folder"],os.path.basename(instance["yml"])))
+            continue
+        if not files:
+            continue
+        try:
+            instance["staged"] = stage_files(get_instance_manifest(instance["folder"]),files)
+        except Exception as e:
+            lines = print_line(lines," - {}: Failed to stage, leaving it untouched: {}".format(instance["folder"],e))
+    cleanup(temp)
+    try: STORE.evict()
+    except: pass
+    t = timed(timings,"stage",t)
+    roll_instances(lines,instances,restart,batch_size,ready_timeout,settings,timings)
+
+def roll_instances(lines,instances,restart,batch_size,ready_timeout,settings,timings=None):
+    # Instances with changes - or that should be running but aren't - are
+    # stopped, swapped and started a batch at a time.  If any instance in a
+    # batch fails, the remaining batches are left alone.
+    todo = []
+    for instance in instances:
+        if instance.get("rollback"):
+            if install.load_manifest(get_instance_manifest(instance["folder"]))["files"]:
+                todo.append(instance)
+        elif instance["staged"] or (restart and not get_instance_pids(instance["folder"])):
+            todo.append(instance)
+    if not todo:
+        lines = print_line(lines,"\nNothing to do - every instance is up to date{}\n".format(" and running" if restart else ""))
+        report_timings(timings)
+        exit()
+    lines = print_line(lines,"\n{} {} instance{}, {} at a time...".format(
+        "Restarting" if restart else "Updating",
+        len(todo),
+        "" if len(todo) == 1 else "s",
+        batch_size
+    ))
+    failed = False
+    t = time.time()
+    for start in range(0,len(todo),batch_size):
+        batch = todo[start:start+batch_size]
+        results = run_concurrently(*[(roll_instance,(instance,),{
+            "restart":restart,
+            "ready_timeout":ready_timeout,
+            "ready_check":settings["ready_check"],
+            "kill_grace":settings["kill_grace"]
+        }) for instance in batch])
+        for instance,result in zip(batch,results):
+            success,message = result or (False,"unknown error")
+            lines = print_line(lines," - {}: {}".format(instance["folder"],message))
+            failed = failed or not success
+        if failed:
+            # Keep what capacity we have left
+            for instance in todo[start+batch_size:]:
+                if instance["staged"]:
+                    instance["staged"].discard()
+                lines = print_line(lines," - {}: Skipped".format(instance["folder"]))
+            break
+    print("")
+    if failed:
+        timed(timings,"roll",t,failed=True)
+    else:
+        timed(timings,"roll",t)
+    report_timings(timings)
+    exit(1 if failed else 0)
+
+def run_git(git,args):
+    # Run git in our own folder - returns its stripped output, or None if it
+    # failed.  Prompts for credentials are disabled so we never hang.
+    env = dict(os.environ)
+    env["GIT_TERMINAL_PROMPT"] = "0"
+    try:
+        p = subprocess.Popen(
+            [git]+args,
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            env=env,
+            stdin=getattr(subprocess,"DEVNULL",open(os.devnull,"r")),
+            stderr=getattr(subprocess,"DEVNULL",open(os.devnull,"w")),
+            stdout=subprocess.PIPE
+        )
+        o,e = p.communicate()
+    except:
+        return None
+    if p.returncode != 0:
+        return None
+    return o.decode("utf-8","ignore").strip()
+
+def check_self_update(git,ttl=0):
+    # Compare our HEAD with the upstream branch via git ls-remote, and only
+    # pull if the remote has something we don't.  A check that found us up
+    # to date is trusted for ttl seconds as long as HEAD hasn't moved.
+    # Returns a (updated, status) tuple.
+    head = run_git(git,["rev-parse","HEAD"])
+    if not head:
+        return (False,"not a git checkout")
+    state_path = os.path.join(CACHE_DIR,"self_update.json")
+    state = load_json(state_path) or {}
+    if ttl > 0 and state.get("head") == head and time.time()-state.get("checked",0) < ttl:
+        return (False,"up to date (checked {} ago)".format(format_seconds(time.time()-state["checked"])))
+    upstream = run_git(git,["rev-parse","--abbrev-ref","--symbolic-full-name","@{u}"])
+    if not upstream or not "/" in upstream:
+        return (False,"no upstream branch to check")
+    remote,branch = upstream.split("/",1)
+    output = run_git(git,["ls-remote",remote,"refs/heads/{}".format(branch)])
+    if not output:
+        return (False,"could not reach {}".format(remote))
+    remote_head = output.split()[0]
+    # Nothing to pull if the remote is at - or behind - our HEAD
+    if remote_head != head and run_git(git,["merge-base","--is-ancestor",remote_head,head]) is None:
+        if run_git(git,["pull"]) is None:
+            return (False,"git pull failed")
+        new_head = run_git(git,["rev-parse","HEAD"])
+        if new_head and new_head != head:
+            save_json(state_path,{"head":new_head,"checked":time.time()})
+            return (True,"updated to {}".format(new_head[:7]))
+    save_json(state_path,{"head":head,"checked":time.time()})
+    return (False,"up to date")
+
+def start_self_update(ttl=0):
+    # Kick off check_self_update() on a background thread so it can run
+    # alongside everything else - pass the result to finish_self_update()
+    git = get_bin_path("git")
+    if not git:
+        return None
+    check = {"start":time.time()}
+    def worker():
+        try:
+            check["result"] = check_self_update(git,ttl=ttl)
+        except Exception as e:
+            check["result"] = (False,"failed: {}".format(e))
+        check["end"] = time.time()
+    t = threading.Thread(target=worker)
+    t.daemon = True
+    t.start()
+    check["thread"] = t
+    return check
+
+def finish_self_update(lines,check,timings=None,timeout=None,restart=True):
+    # Wait for the self update check - restarting into the new version if it
+    # pulled anything and restart is True.  Only the first call for a check
+    # reports it, and if timeout passes first it's left to finish (or not)
+    # on its own.
+    if not check or check.get("done"):
+        return lines
+    check["done"] = True
+    if check.get("thread"):
+        try:
+            # Join on a timeout so KeyboardInterrupt is still honored
+            wait_until = None if timeout is None else time.time()+timeout
+            while check["thread"].is_alive():
+                if wait_until is not None and time.time() >= wait_until:
+                    return print_line(lines," - Lavalink-Updater: still checking after {:,}s, skipped".format(timeout))
+                check["thread"].join(0.1)
+        except KeyboardInterrupt:
+            print("\n - Keyboard interrupt, exiting...\n")
+            exit()
+        check["thread"] = None
+        if timings is not None:
+            timings.add_concurrent("self-update",check["start"],check["end"])
+    updated,status = check["result"]
+    lines = print_line(lines," - Lavalink-Updater: {}".format(status))
+    if updated and restart:
+        lines = print_line(lines," - Restarting...\n")
+        restart_self()
+    return lines
+
+def restart_self():
+    # Replace this process with a fresh run of the updated script
+    sys.stdout.flush()
+    args = [sys.executable,os.path.realpath(__file__)]+sys.argv[1:]
+    if os.name == "nt":
+        # execv on Windows spawns a new process and exits this one, which
+        # hands the console back mid-run - so wait on a child instead
+        p = subprocess.Popen(args)
+        try:
+            p.communicate()
+        except KeyboardInterrupt:
+            exit()
+        exit(p.returncode)
+    if DL:
+        DL.close()
+    os.execv(sys.executable,args)
+
 def main(
     skip_git = False,
     list_update = False,
@@ -354,251 +1687,280 @@ def main(
     force_if_different = False,
     prompt_answer = None,
     l_target = None,
-    y_target = None
+    y_target = None,
+    hash_jar = False,
+    race = False,
+    cache_ttl = 0,
+    cache_stats = False,
+    segments = 1,
+    cache_dir = None,
+    cache_max_size = 0,
+    kill_grace = None,
+    plugin_targets = None,
+    rollback = False,
+    warm_up = False,
+    show_timings = False,
+    ready_timeout = 0,
+    ready_check = "http",
+    supervise = False,
+    max_restarts = SUPERVISE_MAX_RESTARTS,
+    restart_window = SUPERVISE_WINDOW,
+    supervise_update = False,
+    header = True,
+    instances = None,
+    batch_size = 1,
+    launch_profile = None,
+    profile_startup = False,
+    metrics_json = None,
+    metrics_prom = None,
+    index_ttl = RELEASE_INDEX_TTL,
+    self_update_ttl = SELF_UPDATE_TTL
     ):
+    # Keep our settings around so we can re-run the update check while
+    # supervising
+    settings = dict(locals())
+    global LAUNCH_PROFILE, RELEASE_INDEX_TTL
+    LAUNCH_PROFILE = launch_profile
+    RELEASE_INDEX_TTL = index_ttl
     lines = []
-    if not list_update:
+    if not list_update and header:
         # Print the header if we're doing more than listing updates
         u.head()
         lines = print_line(lines,"\n{}: Starting Lavalink update...\n".format(datetime.datetime.now().time().isoformat()))
-    if not skip_git:
-        # Self update check unless explicitly told to skip
-        git = get_bin_path("git")
-        if git:
-            lines = print_line(lines,"Checking for Lavalink-Updater updates...")
-            # Try our update
-            updated = False
-            cwd = os.getcwd()
-            os.chdir(os.path.dirname(os.path.realpath(__file__)))
-            try:
-                p = subprocess.Popen(
-                    [git,"pull"],
-                    stderr=getattr(subprocess,"DEVNULL",open(os.devnull,"w")),
-                    stdout=subprocess.PIPE
-                )
-                o,e = p.communicate()
-                if p.returncode == 0 and not "up to date" in o.decode("utf-8"):
-                    updated = True
-            except:
-                pass
-            os.chdir(cwd)
-            if updated:
-                lines = print_line(lines," - Updated, restarting...\n")
-                # Restart ourselves via subprocess
-                p = subprocess.Popen([sys.executable,os.path.realpath(__file__)]+sys.argv[1:])
-                try:
-                    p.communicate()
-                except KeyboardInterrupt:
-                    exit()
-                exit(p.returncode)
-            lines = print_line(lines," - Already up to date\n")
-    # Gather info as needed - first check for java
-    if not JAVA_PATH:
-        print("Could not locate java!")
-        print("")
-        exit(1)
-    # Let's verify if we have an application.yml or not - and inform the user
-    if not os.path.isfile(YML_PATH):
-        print("{} not found!\n".format(YML_PATH))
-        print("Please visit the following link to create one:")
-        print(" - {}\n".format(DOC_URL))
-        exit(1)
-    # Scrape the Lavalink and YouTube-Source versions
-    lines = print_line(lines,"Local versions:")
-    ll_version = check_lavalink_version(LAVALINK_PATH)
-    lines = print_line(lines," - Lavalink: {}".format(ll_version or "MISSING"))
-    yts_version = check_yts_version(YML_PATH)
-    plugin_dir = check_plugin_dir(YML_PATH)
-    if not plugin_dir:
-        print("Could not locate a valid pluginsDir in {}!\n".format(YML_PATH))
-        print("Please ")
-    yts_path = os.path.join(plugin_dir,"youtube-plugin-{}.jar".format(yts_version))
-    lines = print_line(lines," - YouTube-Source: {}{}".format(
-        yts_version or "MISSING",
-        " - PLUGIN FOLDER MISSING" if not os.path.isdir(plugin_dir) \
-        else " - FILE MISSING" if not os.path.isfile(yts_path) else ""
-    ))
-    if not yts_version:
-        print("\nCould not locate youtube-plugin information in")
-        print(" - {}".format(YML_PATH))
-        print("")
-        print("Please visit the following link for info:")
-        print(" - {}\n".format(DOC_URL))
-        exit(1)
-    # The GitHub API expects api.github.com/repos/OWNER/REPO/releases/tags/TAG
-    # if not latest
-    y_api_target = l_api_target = None
-    if l_target:
-        l_target = quote(l_target)
-        l_api_target = "tags/{}".format(l_target)
-    if y_target:
-        y_target = quote(y_target)
-        y_api_target = "tags/{}".format(y_target)
-    # If we're only forcing when different - check if they're not equal,
-    # otherwise check for remote > local
-    allowed_comparisons = (True,False) if force_if_different else (True,)
-    lines = print_line(lines,"Remote versions:")
-    l_success,l_version,l_url = get_latest_info(
-        LAVALINK_URL.format(l_target or "latest"),
-        LAVALINK_API.format(l_api_target or "latest"),
-        LAVALINK_REG,
-        prioritize_html=prioritize_html
-    )
-    if not l_success:
-        lines = print_line(lines," - Lavalink: Error checking for updates")
-    else:
-        lines = print_line(lines," - Lavalink: {}".format(l_version))
-    y_success,y_version,y_url = get_latest_info(
-        YTSOURCE_URL.format(y_target or "latest"),
-        YTSOURCE_API.format(y_api_target or "latest"),
-        YTSOURCE_REG,
-        prioritize_html=prioritize_html
-    )
-    if not y_success:
-        lines = print_line(lines," - YouTube-Source: Error checking for updates")
-    else:
-        lines = print_line(lines," - YouTube-Source: {}".format(y_version))
-    if list_update:
-        # Print if either needs an update
-        if y_version or l_version:
-            lines = print_line(lines,"")
-        if l_version:
-            if ll_version is None or u.compare_versions(ll_version,l_version):
-                lines = print_line(lines,"Lavalink update available")
-            else:
-                lines = print_line(lines,"Lavalink is up to date")
-        if y_version:
-            if yts_version is None or u.compare_versions(yts_version,y_version):
-                lines = print_line(lines,"YouTube-Source update available")
+    if profile_startup:
+        marks = list(STARTUP)
+        if DL:
+            # The SSL context waits for the first https request - build it
+            # now to show what that will cost
+            DL.get_ssl_context()
+            marks.append(("SSL context (deferred)",time.time()))
+        print_startup(marks)
+    if cache_dir or cache_max_size:
+        set_cache_dir(cache_dir or CACHE_DIR,max_size=cache_max_size)
+    # Everything up to stopping the running instance happens while it's
+    # still serving - only the stop, activate and launch stages are downtime
+    timings = None
+    if show_timings or metrics_json or metrics_prom:
+        timings = metrics.Spans(get_counters,show=show_timings,json_path=metrics_json,prom_path=metrics_prom)
+    # Self update check unless explicitly told to skip - it runs in the
+    # background and is waited on before anything is changed
+    self_update = None if skip_git else start_self_update(ttl=self_update_ttl)
+    try:
+        # Gather info as needed - first check for java
+        if not JAVA_PATH:
+            print("Could not locate java!")
+            print("")
+            exit(1)
+        if instances:
+            # Each instance folder brings its own application.yml
+            if self_update:
+                lines = print_line(lines,"Checking for Lavalink-Updater updates...")
+                lines = finish_self_update(lines,self_update,timings)
+                lines = print_line(lines,"")
+            update_instances(instances,settings,timings)
+        # Let's verify if we have an application.yml or not - and inform the user
+        if not os.path.isfile(YML_PATH):
+            print("{} not found!\n".format(YML_PATH))
+            print("Please visit the following link to create one:")
+            print(" - {}\n".format(DOC_URL))
+            exit(1)
+        check_launch_profile(os.path.dirname(YML_PATH))
+        if rollback:
+            # Restore the last install instead of checking for updates
+            if self_update:
+                lines = print_line(lines,"Checking for Lavalink-Updater updates...")
+                lines = finish_self_update(lines,self_update,timings)
+                lines = print_line(lines,"")
+            t = time.time()
+            lines,prompt_answer = rollback_install(lines,prompt_answer=prompt_answer,kill_grace=kill_grace)
+            timed(timings,"rollback",t)
+            if only_update:
+                report_timings(timings)
+                exit()
+            launch_lavalink(
+                lines,
+                prompt_answer=prompt_answer,
+                kill_grace=kill_grace,
+                timings=timings,
+                ready_timeout=ready_timeout,
+                ready_check=ready_check,
+                supervise=supervise,
+                max_restarts=max_restarts,
+                restart_window=restart_window
+            )
+        t = time.time()
+        # Scrape the Lavalink and plugin versions
+        lines = print_line(lines,"Local versions:")
+        ll_version = check_lavalink_version(LAVALINK_PATH,include_hash=hash_jar)
+        lines = print_line(lines," - Lavalink: {}".format(ll_version or "MISSING"))
+        plugin_dir = check_plugin_dir(YML_PATH)
+        plugins = get_plugins(YML_PATH)
+        for plugin in plugins:
+            lines = print_line(lines," - {}: {}{}".format(
+                plugin["name"],
+                plugin["version"],
+                " - SNAPSHOT, SKIPPING" if plugin["snapshot"] \
+                else " - PLUGIN FOLDER MISSING" if not os.path.isdir(plugin_dir) \
+                else " - FILE MISSING" if not os.path.isfile(get_plugin_path(plugin_dir,plugin)) else ""
+            ))
+        if not plugins:
+            print("\nCould not locate any plugin dependencies in")
+            print(" - {}".format(YML_PATH))
+            print("")
+            print("Please visit the following link for info:")
+            print(" - {}\n".format(DOC_URL))
+            exit(1)
+        t = timed(timings,"local",t)
+        # Snapshot builds don't have stable jar names - leave those to Lavalink
+        plugins = [p for p in plugins if not p["snapshot"]]
+        l_target,l_api_target,plugin_targets = get_targets(l_target,y_target,plugin_targets)
+        lines,lavalink,remote = resolve_remote(
+            lines,
+            plugins,
+            l_target,
+            l_api_target,
+            plugin_targets,
+            cache_ttl=cache_ttl,
+            prioritize_html=prioritize_html,
+            race=race
+        )
+        l_success,l_version,l_url = lavalink
+        for plugin in plugins:
+            plugin["remote"] = remote[plugin_key(plugin,plugin_targets.get(plugin["artifact"]))]
+        lines = finish_self_update(lines,self_update,timings)
+        if cache_stats:
+            if DL.cache:
+                lines = print_line(lines," - {}".format(DL.cache.report()))
+            if DL.pool:
+                lines = print_line(lines," - {}".format(DL.pool.report()))
+        if list_update:
+            # Print if anything needs an update
+            if l_version or any(p["remote"][1] for p in plugins):
+                lines = print_line(lines,"")
+            if l_version:
+                if ll_version is None or u.compare_versions(ll_version,l_version):
+                    lines = print_line(lines,"Lavalink update available")
+                else:
+                    lines = print_line(lines,"Lavalink is up to date")
+            for plugin in plugins:
+                if not plugin["remote"][1]:
+                    continue
+                if u.compare_versions(plugin["version"],plugin["remote"][1]):
+                    lines = print_line(lines,"{} update available".format(plugin["name"]))
+                else:
+                    lines = print_line(lines,"{} is up to date".format(plugin["name"]))
+            exit()
+        downloads,missing = plan_downloads(
+            LAVALINK_PATH,
+            ll_version,
+            plugins,
+            plugin_dir,
+            lavalink,
+            remote,
+            plugin_targets,
+            force=force,
+            update=only_update or update,
+            force_if_different=force_if_different
+        )
+        # We're not explicitly updating these, but their declared file does
+        # not exist - look up the ones we're expecting
+        found = resolve_missing(missing,prioritize_html=prioritize_html,race=race)
+        for plugin in missing:
+            downloads.append(get_plugin_download(plugin,plugin_dir,found[plugin_key(plugin,plugin["version"])]))
+        t = timed(timings,"resolve",t)
+        for name,url,version,dest,plugin in downloads:
+            lines = print_line(lines,"\n{}Updating {}...".format("Force-" if force or force_if_different else "",name))
+            if not any((url,version)):
+                lines = print_line(lines," - Could not resolve URL or version!  Skipping...")
             else:
-                lines = print_line(lines,"YouTube-Source is up to date")
-        exit()
-    # Updates are required if the current file does not exist, if we're
-    # forcing updates, or if our version number means we need one
-    #
-    files_to_update = []
-    # Let's see if we qualify for updates
-    l_allowed = force or ll_version  is None or ((only_update or update) and u.compare_versions(ll_version,l_version)  in allowed_comparisons)
-    y_allowed = force or yts_version is None or ((only_update or update) and u.compare_versions(yts_version,y_version) in allowed_comparisons)
-    # First we check if Lavalink needs to be updated - and download it to a temp dir
-    temp = None
-    if l_allowed:
-        lines = print_line(lines,"\n{}Updating Lavalink...".format("Force-" if force or force_if_different else ""))
-        if not any((l_url,l_version)):
-            lines = print_line(lines," - Could not resolve URL or version!  Skipping...")
-        else:
+                lines = print_line(lines," - Downloading {} ({})...".format(os.path.basename(url),version))
+        if get_download_urls(downloads):
             lines = print_line(lines,"")
-            lines = print_line(lines,"Downloading {} ({})...".format(os.path.basename(l_url),l_version))
-            temp = temp or tempfile.mkdtemp()
-            try:
-                ll_temp = DL.stream_to_file(l_url,os.path.join(temp,os.path.basename(l_url)))
-                assert ll_temp is not None
-                # Add it to the list of files to update
-                files_to_update.append((
-                    ll_temp,
-                    LAVALINK_PATH,
-                    l_version
+        # Download everything we need to a temp dir at once
+        lines,temp,fetched = fetch_downloads(lines,downloads,segments=segments)
+        t = timed(timings,"download",t)
+        if cache_stats and DL.pool and temp:
+            lines = print_line(lines,"\n{}".format(DL.pool.report()))
+        jar = get_fetched_jar(downloads,fetched)
+        if warm_up and jar:
+            lines,success = verify_jar(lines,jar)
+            if not success:
+                lines = print_line(lines," --> Leaving the current install untouched\n")
+                cleanup(temp)
+                timed(timings,"verify",t,failed=True)
+                report_timings(timings)
+                exit(1)
+            t = timed(timings,"verify",t)
+        files_to_update = get_install_files(downloads,fetched,YML_PATH,temp)
+        if files_to_update is None:
+            lines = print_line(lines," - Failed to update {}".format(os.path.basename(YML_PATH)))
+            lines = print_line(lines," --> Leaving the current install untouched")
+            files_to_update = []
+        staged = None
+        if files_to_update:
+            lines = print_line(lines,"\nStaging files...")
+            for src,dest,vers in files_to_update:
+                lines = print_line(lines," - {}{}".format(
+                    os.path.basename(src),
+                    " ({})".format(vers) if vers else ""
                 ))
-            except Exception as e:
-                lines = print_line(lines," - Failed to download: {}".format(e))
-    if y_allowed or not os.path.isfile(yts_path):
-        lines = print_line(lines,"\n{}Updating YouTube-Source...".format("Force-" if force or force_if_different else ""))
-        if not y_allowed and yts_version:
-            # We're not explicitly updating, but our declared
-            # file does not exist.  Let's override the search
-            # values with the one we're expecting.
-            y_target = quote(yts_version)
-            y_api_target = "tags/{}".format(y_target)
-            y_success,y_version,y_url = get_latest_info(
-                YTSOURCE_URL.format(y_target or "latest"),
-                YTSOURCE_API.format(y_api_target or "latest"),
-                YTSOURCE_REG,
-                prioritize_html=prioritize_html
-            )
-        if not any((y_url,y_version)):
-            lines = print_line(lines," - Could not resolve URL or version!  Skipping...")
-        else:
-            lines = print_line(lines,"")
-            lines = print_line(lines,"Downloading {} ({})...".format(os.path.basename(y_url),y_version))
-            temp = temp or tempfile.mkdtemp()
             try:
-                yt_temp = DL.stream_to_file(y_url,os.path.join(temp,os.path.basename(y_url)))
-                assert yt_temp is not None
-                # Update the yml to expect the new version
-                yml_temp = update_yts_version(YML_PATH,y_version,temp)
-                assert yml_temp is not None
-                # Add both to the list of files to update
-                files_to_update.extend([
-                    (
-                        yt_temp,
-                        os.path.join(plugin_dir,os.path.basename(yt_temp)),
-                        y_version
-                    ),
-                    (
-                        yml_temp,
-                        YML_PATH,
-                        y_version
-                    )
-                ])
+                staged = stage_files(INSTALL_MANIFEST,files_to_update)
             except Exception as e:
-                lines = print_line(lines," - Failed to download: {}".format(e))
-    if files_to_update:
-        # Iterate the files we need to update
-        lines = print_line(lines,"\nMoving files into place...")
-        # Prompt to quit other instances - even if just updating
-        prompt_answer,printed = check_pids(prompt_answer=prompt_answer,temp=temp)
-        if printed:
-            # Re-print our prior lines
-            u.head()
-            print("\n".join(lines))
-        for src,dest,vers in files_to_update:
-            lines = print_line(lines," - {}{}".format(
-                os.path.basename(src),
-                " ({})".format(vers) if vers else ""
-            ))
+                # Don't activate a partial set
+                lines = print_line(lines," --> Failed to stage: {}".format(e))
+                lines = print_line(lines," --> Leaving the current install untouched")
+        # Clean up the temp directory, if any
+        cleanup(temp)
+        # Trim the artifact store back down to size if needed
+        try: STORE.evict()
+        except: pass
+        t = timed(timings,"stage",t)
+        if staged:
+            # Prompt to quit other instances - even if just updating
+            try:
+                prompt_answer,printed = check_pids(prompt_answer=prompt_answer,kill_grace=kill_grace)
+            except SystemExit:
+                staged.discard()
+                raise
+            t = timed(timings,"stop",t)
+            if printed:
+                # Re-print our prior lines
+                u.head()
+                print("\n".join(lines))
+            lines = print_line(lines,"\nMoving files into place...")
             try:
-                if not os.path.isdir(os.path.dirname(dest)):
-                    # Attempt to create missing directories
-                    os.makedirs(os.path.dirname(dest))
-                # Copy the target file
-                shutil.move(src,dest)
+                staged.activate()
+                lines = print_line(lines," - Done")
             except Exception as e:
-                lines = print_line(lines," --> Failed to copy: {}".format(e))
-    # Clean up the temp directory, if any
-    cleanup(temp)
-    if only_update:
-        # Bail here if we're only updating
-        exit()
-    # Kill the running instance if any
-    prompt_answer,printed = check_pids(prompt_answer=prompt_answer)
-    if printed:
-        # Re-print our prior lines
-        u.head()
-        print("\n".join(lines))
-    # Start the new version as needed
-    print("\nStarting Lavalink.jar...")
-    if not os.path.isfile(LAVALINK_PATH):
-        print(" - File does not exist!\n")
-        exit(1)
-    print("")
-    cwd = os.getcwd()
-    os.chdir(os.path.dirname(os.path.realpath(__file__)))
-    lavalink = subprocess.Popen([JAVA_PATH,"-jar",LAVALINK_PATH])
-    os.chdir(cwd)
-    try:
-        lavalink.communicate()
-    except KeyboardInterrupt:
-        print("\n - Keyboard interrupt, exiting...\n")
-        exit()
-    try:
-        exit(lavalink.returncode)
-    except:
-        # We couldn't get the return code - the process
-        # was likely killed - so exit with a 0 status
-        exit(0)
+                lines = print_line(lines," --> Failed to move files, restored the previous install: {}".format(e))
+            t = timed(timings,"activate",t)
+        if only_update:
+            # Bail here if we're only updating
+            report_timings(timings)
+            exit()
+        launch_lavalink(
+            lines,
+            prompt_answer=prompt_answer,
+            kill_grace=kill_grace,
+            timings=timings,
+            ready_timeout=ready_timeout,
+            ready_check=ready_check,
+            supervise=supervise,
+            max_restarts=max_restarts,
+            restart_window=restart_window,
+            update_check=(lambda:check_for_updates(settings)) if supervise and supervise_update else None
+        )
+    finally:
+        # Early exits (listing, rollback, failures) still wait on the check
+        # - but only so long, and without restarting on the way out
+        finish_self_update(lines,self_update,timings,timeout=SELF_UPDATE_WAIT,restart=False)
 
+STARTUP.append(("globals",time.time()))
 JAVA_PATH = get_bin_path("java")
-USE_WMIC = get_bin_path("wmic")
+# Only Windows uses wmic - no need to look for it elsewhere
+USE_WMIC = get_bin_path("wmic") if os.name == "nt" else None
+USE_PROC = sys.platform.startswith("linux") and os.path.isfile("/proc/self/cmdline")
 if os.name == "nt":
     if USE_WMIC:
         COMMAND_REG = re.compile(r"(?i)^(?P<command>.*)\s+(?P<pid>\d+).*$")
@@ -606,22 +1968,66 @@ if os.name == "nt":
         COMMAND_REG = re.compile(r"(?i)^\s*(?P<pid>\d+)\s+(?P<command>.*)$")
 else:
     COMMAND_REG = re.compile(r"(?i)^([^\s]+\s+)(?P<pid>\d+)\s+([^\s]+\s+){8}(?P<command>.*)$")
+STARTUP.append(("binary lookup",time.time()))
 
 if __name__ == "__main__":
     # Setup the cli args
-    parser = argparse.ArgumentParser(prog="Lavalink.py", description="Lavalink.py - a py script to update and launch Lavalink.jar")
-    parser.add_argument("-c", "--check-updates", help="only report the latest Lavalink and YouTube-Source versions (implies --skip-git, overrides all but --help)", action="store_true")
-    parser.add_argument("-l", "--lavalink-version", help="update Lavalink.jar to the passed version tag instead of \"latest\" if it exists (requires --force[-if-different] if passing an older version)")
-    parser.add_argument("-y", "--yts-version", help="update YouTube-Source to the passed version tag instead of \"latest\" if it exists (requires --force[-if-different] if passing an older version)")
-    parser.add_argument("-f", "--force", help="force Lavalink.jar and YouTube-Source updates (overrides --force-if-different)", action="store_true")
-    parser.add_argument("-d", "--force-if-different", help="force Lavalink.jar and YouTube-Source updates only if the local and remote versions are different", action="store_true")
+    parser = argparse.ArgumentParser(prog="Lavalink.py", description="Lavalink.py - a py script to update and launch Lavalink.jar and its plugins")
+    parser.add_argument("-c", "--check-updates", help="only report the latest Lavalink and plugin versions (implies --skip-git, overrides all but --help)", action="store_true")
+    parser.add_argument("-l", "--lavalink-version", help="update Lavalink.jar to the passed version tag - or the newest in a range like 4.x, ~4.0 or \">=4.0,<4.1\" - instead of \"latest\" if it exists (requires --force[-if-different] if passing an older version)")
+    parser.add_argument("-y", "--yts-version", help="update YouTube-Source to the passed version tag or range instead of \"latest\" if it exists (requires --force[-if-different] if passing an older version)")
+    parser.add_argument("-v", "--plugin-version", help="update the plugin with the passed artifact name to the passed version or range instead of the latest if it exists - can be used more than once (i.e. lavasrc-plugin=4.2.0 or lavasrc-plugin=4.x)", action="append", default=[], metavar="ARTIFACT=VERSION")
+    parser.add_argument("-f", "--force", help="force Lavalink.jar and plugin updates (overrides --force-if-different)", action="store_true")
+    parser.add_argument("-d", "--force-if-different", help="force Lavalink.jar and plugin updates only if the local and remote versions are different", action="store_true")
     parser.add_argument("-s", "--skip-updates", help="skip update checks (overrides --force)", action="store_true")
     parser.add_argument("-o", "--only-update", help="only update, don't start Lavalink (overrides --skip-updates)", action="store_true")
     parser.add_argument("-g", "--skip-git", help="GitHub self updates", action="store_true")
+    parser.add_argument("--self-update-ttl", help="seconds to trust the last Lavalink-Updater update check before comparing with the remote again (default is {} - always compare)".format(SELF_UPDATE_TTL), type=int, default=SELF_UPDATE_TTL)
     parser.add_argument("-p", "--prioritize-html", help="attempt to scrape html for updates before falling back on the GitHub JSON API (by default, the API is checked first)", action="store_true")
+    parser.add_argument("--race", help="query the GitHub JSON API and html at the same time and use whichever answers first (overrides --prioritize-html)", action="store_true")
+    parser.add_argument("--cache-ttl", help="seconds to trust cached GitHub API responses without contacting GitHub (default is 0 - always revalidate)", type=int, default=0)
+    parser.add_argument("--cache-stats", help="report HTTP cache hits/misses and connection reuse after checking remote versions and downloading", action="store_true")
+    parser.add_argument("--segments", help="download each file over this many concurrent ranged connections when the server supports it (default is 1)", type=int, default=1)
+    parser.add_argument("--cache-dir", help="folder to keep cached versions, GitHub responses and downloaded jars in (default is .cache next to Lavalink.py)")
+    parser.add_argument("--index-ttl", help="seconds to resolve version ranges from the local release index before checking GitHub for newer releases (default is {})".format(RELEASE_INDEX_TTL), type=int, default=RELEASE_INDEX_TTL)
+    parser.add_argument("--cache-max-size", help="trim stored jars back to this size (e.g. 500MB, 2GiB), least recently used first - 0 disables the limit (default is 1GB)", default="1GB")
+    parser.add_argument("--kill-grace", help="seconds to wait for running instances to exit before forcefully killing them (default is {})".format(KILL_GRACE), type=float, default=KILL_GRACE)
+    parser.add_argument("--warm-up", help="run the new Lavalink.jar with --version before stopping the running instance, and keep the current install if it fails", action="store_true")
+    parser.add_argument("--timings", help="report how long each update stage took and how long Lavalink was down", action="store_true")
+    parser.add_argument("--metrics-json", help="append each stage's duration, bytes, throughput, retries and cache hits to this file as JSON lines", metavar="PATH")
+    parser.add_argument("--metrics-prom", help="write the last run's stage metrics to this file for the Prometheus node_exporter textfile collector (i.e. lavalink_updater.prom)", metavar="PATH")
+    parser.add_argument("--wait-ready", help="after starting Lavalink, wait up to this many seconds for it to answer on the server.port from application.yml and exit non-zero if it doesn't (default is 0 - don't wait)", type=float, default=0, metavar="SECONDS")
+    parser.add_argument("--ready-check", help="how --wait-ready checks Lavalink - a GET of /version, or just a TCP connect (default is http)", choices=["http","tcp"], default="http")
+    parser.add_argument("--supervise", help="restart Lavalink if it crashes, waiting longer between each restart - a clean exit (code 0) ends supervision", action="store_true")
+    parser.add_argument("--max-restarts", help="give up supervising after this many restarts within --restart-window (default is {})".format(SUPERVISE_MAX_RESTARTS), type=int, default=SUPERVISE_MAX_RESTARTS)
+    parser.add_argument("--restart-window", help="seconds over which --max-restarts are counted - staying up this long also resets the restart delay (default is {})".format(SUPERVISE_WINDOW), type=float, default=SUPERVISE_WINDOW)
+    parser.add_argument("--supervise-update", help="check for and install updates before each supervised restart", action="store_true")
+    parser.add_argument("--instances", help="update and rolling-restart each of the passed folders (each with its own Lavalink.jar and application.yml) instead of the one next to Lavalink.py - instances run in the background and log to lavalink.log", nargs="+", metavar="FOLDER")
+    parser.add_argument("--batch-size", help="how many --instances to restart at once - each batch must be ready before the next is stopped (default is 1)", type=int, default=1)
+    parser.add_argument("--profile", help="JVM launch profile to use from launch.json next to application.yml (default is the file's \"default\" profile)", metavar="NAME")
+    parser.add_argument("--profile-startup", help="print how long imports and initialization took before doing anything else", action="store_true")
+    parser.add_argument("--rollback", help="swap the files from the last update back to the versions they replaced, then start Lavalink as usual - run again to roll forward", action="store_true")
+    parser.add_argument("-a", "--hash-jar", help="include a SHA-256 of Lavalink.jar when checking the cached local version (slower, but catches in-place edits)", action="store_true")
     parser.add_argument("-r", "--handle-running", help="how to handle detected currently running Lavalink.jar instances", choices=["kill","ignore","quit","ask"], default="ask")
 
     args = parser.parse_args()
+    STARTUP.append(("argument parsing",time.time()))
+    plugin_targets = {}
+    for target in args.plugin_version:
+        if not "=" in target:
+            parser.error("invalid --plugin-version value: {} (expected ARTIFACT=VERSION)".format(target))
+        artifact,version = target.split("=",1)
+        plugin_targets[artifact.strip()] = version.strip()
+    for target in [args.lavalink_version,args.yts_version]+list(plugin_targets.values()):
+        if releases.is_constraint(target):
+            try:
+                releases.parse_constraint(target)
+            except ValueError as e:
+                parser.error(str(e))
+    try:
+        cache_max_size = parse_size(args.cache_max_size)
+    except ValueError:
+        parser.error("invalid --cache-max-size value: {}".format(args.cache_max_size))
 
     prompt_dict = {"kill":"y","ignore":"n","quit":"q"}
     main(
@@ -634,5 +2040,31 @@ if __name__ == "__main__":
         force_if_different=args.force_if_different,
         prompt_answer=prompt_dict.get(args.handle_running),
         l_target=args.lavalink_version,
-        y_target=args.yts_version
+        y_target=args.yts_version,
+        hash_jar=args.hash_jar,
+        race=args.race,
+        cache_ttl=args.cache_ttl,
+        cache_stats=args.cache_stats,
+        segments=args.segments,
+        cache_dir=args.cache_dir,
+        cache_max_size=cache_max_size,
+        kill_grace=args.kill_grace,
+        plugin_targets=plugin_targets,
+        rollback=args.rollback,
+        warm_up=args.warm_up,
+        show_timings=args.timings,
+        ready_timeout=args.wait_ready,
+        ready_check=args.ready_check,
+        supervise=args.supervise,
+        max_restarts=args.max_restarts,
+        restart_window=args.restart_window,
+        supervise_update=args.supervise_update,
+        instances=args.instances,
+        batch_size=args.batch_size,
+        launch_profile=args.profile,
+        profile_startup=args.profile_startup,
+        metrics_json=args.metrics_json,
+        metrics_prom=args.metrics_prom,
+        index_ttl=args.index_ttl,
+        self_update_ttl=args.self_update_ttl
     )
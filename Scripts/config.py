@@ -0,0 +1,165 @@
+import os, threading
+from Scripts import utils
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in ('"',"'"):
+        return value[1:-1]
+    return value
+
+def _strip_comment(value):
+    # Drop a trailing " # comment" that isn't inside quotes
+    quote = None
+    for i,c in enumerate(value):
+        if c in ('"',"'"):
+            quote = None if quote == c else quote or c
+        elif c == "#" and quote is None and (i == 0 or value[i-1] in (" ","\t")):
+            return value[:i].rstrip()
+    return value
+
+class ApplicationYml:
+    # Single-pass line index of a Lavalink application.yml.  This isn't a
+    # general YAML parser - it records where the bits we care about live so
+    # they can be read cheaply and rewritten in place:
+    #
+    # - keys: dotted key path (i.e. server.port) -> (line index, raw value)
+    # - dependencies: each "- dependency:" entry with its group, artifact,
+    #   version and the column span of the version within its line, plus any
+    #   settings nested under it
+    # - plugins_dir_line: the line index of the pluginsDir entry, if any
+
+    def __init__(self, path, text = None):
+        self.path = os.path.realpath(path)
+        if text is None:
+            with open(self.path) as f:
+                text = f.read()
+        self.lines = text.split("\n")
+        self.keys = {}
+        self.dependencies = []
+        self.plugins_dir_line = None
+        self._parse()
+
+    @classmethod
+    def load(cls, path):
+        # Returns a cached model for path - reparsed only if the file changed
+        path = os.path.realpath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime,st.st_size,st.st_ino)
+        with _cache_lock:
+            cached = _cache.get(path)
+            if cached and cached[0] == stamp:
+                return cached[1]
+        model = cls(path)
+        with _cache_lock:
+            _cache[path] = (stamp,model)
+        return model
+
+    def _parse(self):
+        stack = [] # (indent, key) pairs for the current key path
+        item = None # (indent, dependency) for the list item we're within
+        for i,line in enumerate(self.lines):
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            indent = len(line)-len(line.lstrip())
+            if stripped.startswith("- "):
+                dep = self._parse_item(i,line)
+                item = (indent,dep) if dep else None
+                continue
+            if not ":" in stripped:
+                continue
+            key,value = stripped.split(":",1)
+            key = _unquote(key)
+            if item and indent > item[0]:
+                # Extra settings for the dependency above (i.e. repository
+                # or snapshot)
+                item[1][key] = _unquote(_strip_comment(value.strip()))
+                continue
+            item = None
+            while stack and stack[-1][0] >= indent:
+                stack.pop()
+            stack.append((indent,key))
+            value = _strip_comment(value.strip())
+            self.keys[".".join(k for _,k in stack)] = (i,value)
+            if key == "pluginsDir":
+                self.plugins_dir_line = i
+
+    def _parse_item(self, index, line):
+        marker = "- dependency:"
+        if not marker in line:
+            return None
+        start = line.index(marker)+len(marker)
+        raw = _strip_comment(line[start:])
+        coordinate = _unquote(raw)
+        parts = coordinate.split(":")
+        if len(parts) < 3:
+            return None
+        # Work out where the version sits in the line so we can swap just
+        # that span later
+        version = parts[-1]
+        version_end = start + line[start:].index(coordinate) + len(coordinate)
+        dep = {
+            "line":index,
+            "group":parts[0],
+            "artifact":parts[1],
+            "version":version,
+            "start":version_end-len(version),
+            "end":version_end
+        }
+        self.dependencies.append(dep)
+        return dep
+
+    def get(self, key, default = None):
+        # Returns the unquoted value for a dotted key path
+        entry = self.keys.get(key)
+        if entry is None or not entry[1]:
+            return default
+        return _unquote(entry[1])
+
+    def get_dependency(self, group, artifact):
+        for dep in self.dependencies:
+            if dep["group"] == group and dep["artifact"] == artifact:
+                return dep
+        return None
+
+    def plugins_dir(self):
+        # Resolve pluginsDir relative to the yml's folder - falling back on
+        # the default of ./plugins
+        base = os.path.dirname(self.path)
+        if self.plugins_dir_line is None:
+            return os.path.join(base,"plugins")
+        value = _unquote(_strip_comment(self.lines[self.plugins_dir_line].split("pluginsDir:",1)[1].strip()))
+        if not value:
+            return os.path.join(base,"plugins")
+        return os.path.realpath(os.path.join(base,os.path.expanduser(value)))
+
+    def set_dependency_version(self, group, artifact, version):
+        # Swap the version span of the matching dependency line - returns
+        # False if it wasn't found
+        dep = self.get_dependency(group, artifact)
+        if not dep:
+            return False
+        line = self.lines[dep["line"]]
+        self.lines[dep["line"]] = line[:dep["start"]]+version+line[dep["end"]:]
+        dep["end"] = dep["start"]+len(version)
+        dep["version"] = version
+        return True
+
+    def copy(self):
+        # Returns an independent model to make changes to, leaving the
+        # cached one untouched
+        return ApplicationYml(self.path, text=self.text())
+
+    def text(self):
+        return "\n".join(self.lines)
+
+    def write(self, path = None):
+        # Write our lines to path (or back to our source) via a temp file
+        # that's swapped into place
+        return utils.atomic_write(path or self.path,self.text())
@@ -1,14 +1,19 @@
-import sys, os, time, ssl, gzip, multiprocessing
+import sys, os, time, ssl, zlib, json, hashlib, threading
+from Scripts import utils
 from io import BytesIO
 # Python-aware urllib stuff
 try:
-    from urllib.request import urlopen, Request
-    import queue as q
+    from urllib.request import urlopen, Request, getproxies, proxy_bypass
+    from urllib.error import HTTPError
+    from urllib.parse import urlsplit, urljoin
+    from http.client import HTTPConnection, HTTPSConnection
 except ImportError:
     # Import urllib2 to catch errors
     import urllib2
-    from urllib2 import urlopen, Request
-    import Queue as q
+    from urllib2 import urlopen, Request, HTTPError
+    from urllib import getproxies, proxy_bypass
+    from urlparse import urlsplit, urljoin
+    from httplib import HTTPConnection, HTTPSConnection
 
 TERMINAL_WIDTH = 120 if os.name=="nt" else 80
 
@@ -46,17 +51,71 @@ def get_size(size, suffix=None, use_1024=False, round_to=2, strip_zeroes=False):
     b = b.rstrip("0") if strip_zeroes else b.ljust(round_to,"0") if round_to > 0 else ""
     return "{:,}{} {}".format(int(a),"" if not b else "."+b,biggest)
 
-def _process_hook(queue, total_size, bytes_so_far=0, update_interval=1.0, max_packets=0):
-    packets = []
-    speed = remaining = ""
-    last_update = time.time()
-    while True:
-        # Write our info first so we have *some* status while
-        # waiting for packets
-        if total_size > 0:
-            percent = float(bytes_so_far) / total_size
+def get_remaining(seconds_left):
+    # Format the passed seconds as [D:]HH:MM:SS
+    days  = seconds_left // 86400
+    hours = (seconds_left - (days*86400)) // 3600
+    mins  = (seconds_left - (days*86400) - (hours*3600)) // 60
+    secs  = seconds_left - (days*86400) - (hours*3600) - (mins*60)
+    if days > 99:
+        return "??"
+    return "{}{:02d}:{:02d}:{:02d}".format(
+        "{}:".format(int(days)) if days else "",
+        int(hours),
+        int(mins),
+        int(round(secs))
+    )
+
+class NullReporter:
+    # Progress reporter that does nothing - used when progress is disabled
+    # or stdout isn't a terminal so non-interactive runs pay no overhead
+
+    def __init__(self, total_size = -1, bytes_so_far = 0, **kwargs):
+        self.total_size = total_size
+        self.bytes_so_far = bytes_so_far
+
+    def start(self):
+        return self
+
+    def update(self, count):
+        pass
+
+    def finish(self):
+        pass
+
+class ProgressReporter(NullReporter):
+    # Renders a progress bar from a daemon thread.  Download loops only bump
+    # a shared counter via update() - the render thread wakes up every
+    # update_interval seconds to draw the current state.
+
+    def __init__(self, total_size = -1, bytes_so_far = 0, update_interval = 1.0, stream = None):
+        NullReporter.__init__(self, total_size, bytes_so_far)
+        self.update_interval = update_interval
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def update(self, count):
+        with self.lock:
+            self.bytes_so_far += count
+
+    def finish(self):
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _render(self, bytes_so_far, speed = "", remaining = ""):
+        if self.total_size > 0:
+            percent = float(bytes_so_far) / self.total_size
             percent = round(percent*100, 2)
-            t_s = get_size(total_size)
+            t_s = get_size(self.total_size)
             try:
                 b_s = get_size(bytes_so_far, t_s.split(" ")[1])
             except:
@@ -64,7 +123,7 @@ def _process_hook(queue, total_size, bytes_so_far=0, update_interval=1.0, max_pa
             perc_str = " {:.2f}%".format(percent)
             bar_width = (TERMINAL_WIDTH // 3)-len(perc_str)
             progress = "=" * int(bar_width * (percent/100))
-            sys.stdout.write("\r\033[K{}/{} | {}{}{}{}{}".format(
+            self.stream.write("\r\033[K{}/{} | {}{}{}{}{}".format(
                 b_s,
                 t_s,
                 progress,
@@ -75,125 +134,371 @@ def _process_hook(queue, total_size, bytes_so_far=0, update_interval=1.0, max_pa
             ))
         else:
             b_s = get_size(bytes_so_far)
-            sys.stdout.write("\r\033[K{}{}".format(b_s, speed))
-        sys.stdout.flush()
-        # Now we gather the next packet
-        try:
-            packet = queue.get(timeout=update_interval)
-            # Packets should be formatted as a tuple of
-            # (timestamp, len(bytes_downloaded))
-            # If "DONE" is passed, we assume the download
-            # finished - and bail
-            if packet == "DONE":
-                print("") # Jump to the next line
+            self.stream.write("\r\033[K{}{}".format(b_s, speed))
+        self.stream.flush()
+
+    def _run(self):
+        start_time = last_time = time.time()
+        start_bytes = last_bytes = self.bytes_so_far
+        speed = remaining = ""
+        while True:
+            finished = self.done.is_set()
+            bytes_so_far = self.bytes_so_far
+            now = time.time()
+            if finished and now > start_time:
+                # Report the average speed over the whole download
+                bytes_speed = (bytes_so_far-start_bytes) / (now-start_time)
+                speed = " | {}/s".format(get_size(bytes_speed,round_to=1))
+                remaining = ""
+            elif last_time > start_time:
+                # Work out the speed since our last render - skipped on the
+                # first pass as we have nothing to compare against
+                bytes_speed = (bytes_so_far-last_bytes) / max(now-last_time,0.001)
+                speed = " | {}/s".format(get_size(bytes_speed,round_to=1))
+                if self.total_size > 0:
+                    remaining = " | {} left".format(
+                        get_remaining((self.total_size-bytes_so_far) / bytes_speed) if bytes_speed else "??"
+                    )
+            last_time,last_bytes = now,bytes_so_far
+            self._render(bytes_so_far,speed,remaining)
+            if finished:
+                self.stream.write("\n") # Jump to the next line
+                self.stream.flush()
                 return
-            # Append our packet to the list and ensure we're not
-            # beyond our max.
-            # Only check max if it's > 0
-            packets.append(packet)
-            if max_packets > 0:
-                packets = packets[-max_packets:]
-            # Increment our bytes so far as well
-            bytes_so_far += packet[1]
-        except q.Empty:
-            # Didn't get anything - reset the speed
-            # and packets
-            packets = []
-            speed = " | 0 B/s"
-            remaining = " | ?? left" if total_size > 0 else ""
-        except KeyboardInterrupt:
-            print("") # Jump to the next line
+            self.done.wait(self.update_interval)
+
+REDIRECT_CODES = (301,302,303,307,308)
+
+class PooledHTTPSConnection(HTTPSConnection):
+    # HTTPSConnection that offers the pool's last TLS session for its host
+    # when connecting, so a new connection can resume rather than perform a
+    # full handshake
+
+    def __init__(self, host, port = None, context = None, pool = None, **kwargs):
+        HTTPSConnection.__init__(self, host, port, context=context, **kwargs)
+        self.ssl_context = context
+        self.pool = pool
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        session = self.pool.sessions.get((self.host,self.port)) if self.pool else None
+        start = time.time()
+        try:
+            self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host, session=session)
+        except TypeError:
+            # No session support
+            self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host)
+        if self.pool:
+            self.pool.record_handshake(self, time.time()-start)
+
+class PooledResponse:
+    # Wraps an http.client response so that closing it hands the connection
+    # back to the pool when the body was fully read - anything not defined
+    # here is passed through to the underlying response
+
+    def __init__(self, pool, key, conn, response, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.headers = getattr(response,"headers",None) or response.msg
+
+    def __getattr__(self, attr):
+        return getattr(self._response, attr)
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self._response.status
+
+    def close(self):
+        if self._conn is None:
             return
-        # If we have packets and it's time for an update, process
-        # the info.
-        update_check = time.time()
-        if packets and update_check - last_update >= update_interval:
-            last_update = update_check # Refresh our update timestamp
-            speed = " | ?? B/s"
-            if len(packets) > 1:
-                # Let's calculate the amount downloaded over how long
-                try:
-                    first,last = packets[0][0],packets[-1][0]
-                    chunks = sum([float(x[1]) for x in packets])
-                    t = last-first
-                    assert t >= 0
-                    bytes_speed = 1. / t * chunks
-                    speed = " | {}/s".format(get_size(bytes_speed,round_to=1))
-                    # Get our remaining time
-                    if total_size > 0:
-                        seconds_left = (total_size-bytes_so_far) / bytes_speed
-                        days  = seconds_left // 86400
-                        hours = (seconds_left - (days*86400)) // 3600
-                        mins  = (seconds_left - (days*86400) - (hours*3600)) // 60
-                        secs  = seconds_left - (days*86400) - (hours*3600) - (mins*60)
-                        if days > 99 or bytes_speed == 0:
-                            remaining = " | ?? left"
-                        else:
-                            remaining = " | {}{:02d}:{:02d}:{:02d} left".format(
-                                "{}:".format(int(days)) if days else "",
-                                int(hours),
-                                int(mins),
-                                int(round(secs))
-                            )
-                except:
-                    pass
-                # Clear the packets so we don't reuse the same ones
-                packets = []
+        conn,self._conn = self._conn,None
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        if reusable:
+            self._pool.release(self._key, conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ConnectionPool:
+    # Keep-alive connections per (scheme, host, port) shared by every request
+    # a Downloader makes, along with the last TLS session seen for each host
+
+    def __init__(self, ssl_context, max_idle = 8, max_redirects = 10, timeout = None):
+        # ssl_context may also be a function that returns one - it's only
+        # called once an https connection is actually needed
+        self.ssl_context = ssl_context
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self.idle = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests":0,"reused":0,"connections":0,"handshakes":0,"resumed":0,"handshake_time":0.0,"retries":0}
+
+    def record_handshake(self, conn, elapsed):
+        with self.lock:
+            self.stats["handshakes"] += 1
+            self.stats["handshake_time"] += elapsed
+            if getattr(conn.sock,"session_reused",False):
+                self.stats["resumed"] += 1
+            session = getattr(conn.sock,"session",None)
+            if session is not None:
+                self.sessions[(conn.host,conn.port)] = session
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def acquire(self, key):
+        # Returns a tuple of (connection, reused)
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return (conns.pop(),True)
+        scheme,host,port = key
+        if scheme == "https":
+            context = self.ssl_context() if callable(self.ssl_context) else self.ssl_context
+            conn = PooledHTTPSConnection(host, port, context=context, pool=self, timeout=self.timeout)
+        else:
+            conn = HTTPConnection(host, port, timeout=self.timeout)
+        self._count("connections")
+        return (conn,False)
+
+    def release(self, key, conn):
+        # TLS 1.3 session tickets only arrive after the handshake, so grab
+        # the latest session for the host now that we've read a response
+        session = getattr(getattr(conn,"sock",None),"session",None)
+        with self.lock:
+            if session is not None:
+                self.sessions[(conn.host,conn.port)] = session
+            conns = self.idle.setdefault(key,[])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle,self.idle = self.idle,{}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def can_handle(self, url):
+        # We leave anything going through a proxy to urllib
+        parts = urlsplit(url)
+        if not parts.scheme in ("http","https"):
+            return False
+        if getproxies().get(parts.scheme):
+            try: return proxy_bypass(parts.hostname)
+            except: return False
+        return True
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        key = (parts.scheme,parts.hostname,parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?"+parts.query
+        # Retry once on a fresh connection if a reused one was closed on us
+        for attempt in range(2):
+            conn,reused = self.acquire(key)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except Exception as e:
+                conn.close()
+                if reused and attempt == 0:
+                    self._count("retries")
+                    continue
+                raise
+            self._count("requests")
+            if reused:
+                self._count("reused")
+            return PooledResponse(self, key, conn, response, url)
+
+    def open(self, url, headers):
+        # Follow redirects ourselves so each hop can reuse its connection.
+        # Non-2xx responses raise HTTPError just like urlopen().
+        for _ in range(self.max_redirects+1):
+            response = self._request(url, headers)
+            code = response.getcode()
+            if code in REDIRECT_CODES and response.headers.get("Location"):
+                # Drain the body so the connection can be reused
+                response.read()
+                response.close()
+                url = urljoin(url, response.headers["Location"])
+                continue
+            if code >= 300:
+                body = response.read()
+                response.close()
+                raise HTTPError(url, code, response.reason, response.headers, BytesIO(body))
+            return response
+        raise HTTPError(url, code, "Too many redirects", response.headers, BytesIO(b""))
+
+    def report(self):
+        saved = self.stats["reused"]
+        average = self.stats["handshake_time"] / self.stats["handshakes"] if self.stats["handshakes"] else 0
+        return "Connections: {} request{} over {} connection{} - {} reused, {} TLS handshake{} ({} resumed), ~{:.0f} ms of handshakes saved".format(
+            self.stats["requests"],
+            "" if self.stats["requests"] == 1 else "s",
+            self.stats["connections"],
+            "" if self.stats["connections"] == 1 else "s",
+            saved,
+            self.stats["handshakes"],
+            "" if self.stats["handshakes"] == 1 else "s",
+            self.stats["resumed"],
+            saved*average*1000
+        )
+
+class HTTPCache:
+
+    def __init__(self, cache_dir, ttl = 0):
+        # cache_dir is where we store the response bodies and their metadata
+        # ttl is the number of seconds a stored response is considered fresh
+        # without checking with the server at all
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = {"hits":0,"revalidated":0,"stale":0,"misses":0}
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return (os.path.join(self.cache_dir,key+".json"),os.path.join(self.cache_dir,key+".body"))
+
+    def _write(self, path, data, mode = "wb"):
+        utils.atomic_write(path,data,mode=mode)
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] = self.stats.get(stat,0)+1
+
+    def load(self, url):
+        # Returns a tuple of (metadata, body) or None if not cached
+        meta_path,body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path,"rb") as f:
+                body = f.read()
+            assert meta.get("url") == url
+        except:
+            return None
+        return (meta,body)
+
+    def save(self, url, headers, body):
+        meta = {
+            "url":url,
+            "etag":headers.get("ETag"),
+            "last_modified":headers.get("Last-Modified"),
+            "fetched":time.time()
+        }
+        meta_path,body_path = self._paths(url)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            self._write(body_path,body)
+            self._write(meta_path,json.dumps(meta),mode="w")
+        except:
+            return None
+        return meta
+
+    def touch(self, url, meta):
+        # Reset the freshness timer on a 304
+        meta["fetched"] = time.time()
+        try: self._write(self._paths(url)[0],json.dumps(meta),mode="w")
+        except: pass
+
+    def is_fresh(self, meta, ttl = None):
+        ttl = self.ttl if ttl is None else ttl
+        try: return ttl > 0 and 0 <= time.time()-meta["fetched"] < ttl
+        except: return False
+
+    def conditional_headers(self, meta, headers):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def report(self):
+        return "HTTP cache: {} hit{}, {} revalidated, {} stale, {} miss{}".format(
+            self.stats["hits"],
+            "" if self.stats["hits"] == 1 else "s",
+            self.stats["revalidated"],
+            self.stats["stale"],
+            self.stats["misses"],
+            "" if self.stats["misses"] == 1 else "es"
+        )
 
 class Downloader:
 
     def __init__(self,**kwargs):
         self.ua = kwargs.get("useragent",{"User-Agent":"Mozilla"})
         self.chunk = 1048576 # 1024 x 1024 i.e. 1MiB
-        if os.name=="nt": os.system("color") # Initialize cmd for ANSI escapes
-        # Provide reasonable default logic to workaround macOS CA file handling 
-        cafile = ssl.get_default_verify_paths().openssl_cafile
-        try:
-            # If default OpenSSL CA file does not exist, use that from certifi
-            if not os.path.exists(cafile):
-                import certifi
-                cafile = certifi.where()
-            self.ssl_context = ssl.create_default_context(cafile=cafile)
-        except:
-            # None of the above worked, disable certificate verification for now
-            self.ssl_context = ssl._create_unverified_context()
+        # Progress reporter class used when progress is requested - only draw
+        # a progress bar if we're attached to a terminal
+        isatty = getattr(sys.stdout,"isatty",None)
+        self.reporter = kwargs.get("reporter",ProgressReporter if isatty and isatty() else NullReporter)
+        # Optional on-disk cache for conditional requests via get_cached_*
+        cache_dir = kwargs.get("cache_dir")
+        self.cache = HTTPCache(cache_dir,kwargs.get("cache_ttl",0)) if cache_dir else None
+        self.color_initialized = False
+        # Loading the CA store is comparatively slow - so the SSL context is
+        # only built when the first https request needs it
+        self.ssl_context = None
+        self.ssl_lock = threading.Lock()
+        # Share keep-alive connections across requests unless told not to
+        self.pool = ConnectionPool(self.get_ssl_context) if kwargs.get("pool",True) else None
+        # Running totals of body bytes read, downloads retried another way, and
+        # how often (and how much) get_bytes() had to move its buffer to grow it
+        self.stats = {"bytes":0,"retries":0,"buffer_copies":0,"bytes_copied":0}
+        self.stats_lock = threading.Lock()
         return
 
+    def count(self, stat, amount = 1):
+        with self.stats_lock:
+            self.stats[stat] = self.stats.get(stat,0)+amount
+
+    def get_ssl_context(self):
+        with self.ssl_lock:
+            if self.ssl_context is not None:
+                return self.ssl_context
+            # Provide reasonable default logic to workaround macOS CA file handling 
+            cafile = ssl.get_default_verify_paths().openssl_cafile
+            try:
+                # If default OpenSSL CA file does not exist, use that from certifi
+                if not os.path.exists(cafile):
+                    import certifi
+                    cafile = certifi.where()
+                self.ssl_context = ssl.create_default_context(cafile=cafile)
+            except:
+                # None of the above worked, disable certificate verification for now
+                self.ssl_context = ssl._create_unverified_context()
+            return self.ssl_context
+
     def _decode(self, value, encoding="utf-8", errors="ignore"):
-        # Helper method to only decode if bytes type
-        if sys.version_info >= (3,0) and isinstance(value, bytes):
+        # Helper method to only decode if bytes type - get_bytes() hands back
+        # a bytearray, which is treated the same
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        if sys.version_info >= (3,0) and isinstance(value, (bytes,bytearray)):
             return value.decode(encoding,errors)
+        if isinstance(value, bytearray):
+            return str(value)
         return value
 
-    def _update_main_name(self):
-        # Windows running python 2 seems to have issues with multiprocessing
-        # if the case of the main script's name is incorrect:
-        # e.g. Downloader.py vs downloader.py
-        #
-        # To work around this, we try to scrape for the correct case if
-        # possible.
-        try:
-            path = os.path.abspath(sys.modules["__main__"].__file__)
-        except AttributeError as e:
-            # This likely means we're running from the interpreter
-            # directly
-            return None
-        if not os.path.isfile(path):
-            return None
-        # Get the file name and folder path
-        name = os.path.basename(path).lower()
-        fldr = os.path.dirname(path)
-        # Walk the files in the folder until we find our
-        # name - then steal its case and update that path
-        for f in os.listdir(fldr):
-            if f.lower() == name:
-                # Got it
-                new_path = os.path.join(fldr,f)
-                sys.modules["__main__"].__file__ = new_path
-                return new_path
-        # If we got here, it wasn't found
-        return None
-
     def _get_headers(self, headers = None):
         # Fall back on the default ua if none provided
         target = headers if isinstance(headers,dict) else self.ua
@@ -204,16 +509,40 @@ class Downloader:
             new_headers[k] = target[k]
         return new_headers
 
+    def _open_url(self, url, headers = None):
+        # Raises on failure - use open_url() to get None instead
+        if self.pool and self.pool.can_handle(url):
+            return self.pool.open(url, self._get_headers(headers))
+        return urlopen(Request(url, headers=self._get_headers(headers)), context=self.get_ssl_context())
+
+    def close(self):
+        # Close any idle pooled connections
+        if self.pool:
+            self.pool.close()
+
     def open_url(self, url, headers = None):
-        headers = self._get_headers(headers)
         # Wrap up the try/except block so we don't have to do this for each function
         try:
-            response = urlopen(Request(url, headers=headers), context=self.ssl_context)
+            response = self._open_url(url, headers)
         except Exception as e:
             # No fixing this - bail
             return None
         return response
 
+    def _get_reporter(self, progress, total_size, bytes_so_far = 0):
+        # Returns a started progress reporter - progress may also be a
+        # reporter class/factory to use in place of our default
+        if not progress:
+            factory = NullReporter
+        elif callable(progress):
+            factory = progress
+        else:
+            factory = self.reporter
+        if factory is ProgressReporter and os.name=="nt" and not self.color_initialized:
+            os.system("color") # Initialize cmd for ANSI escapes
+            self.color_initialized = True
+        return factory(total_size, bytes_so_far).start()
+
     def get_size(self, *args, **kwargs):
         return get_size(*args,**kwargs)
 
@@ -222,56 +551,224 @@ class Downloader:
         if response is None: return None
         return self._decode(response)
 
-    def get_bytes(self, url, progress = True, headers = None, expand_gzip = True):
-        response = self.open_url(url, headers)
+    def get_cached_string(self, url, progress = False, headers = None, expand_gzip = True, ttl = None):
+        response = self.get_cached_bytes(url,progress,headers,expand_gzip,ttl)
+        if response is None: return None
+        return self._decode(response)
+
+    def get_cached_bytes(self, url, progress = False, headers = None, expand_gzip = True, ttl = None):
+        # Like get_bytes(), but answers from the on-disk cache when the entry
+        # is still within its ttl, and otherwise sends a conditional request
+        # so the server can reply with a 304 instead of the full body.
+        if self.cache is None:
+            return self.get_bytes(url,progress,headers,expand_gzip)
+        cached = self.cache.load(url)
+        if cached and self.cache.is_fresh(cached[0],ttl):
+            self.cache.count("hits")
+            return cached[1]
+        headers = self._get_headers(headers)
+        if cached:
+            headers = self.cache.conditional_headers(cached[0],headers)
+        try:
+            response = self._open_url(url, headers)
+        except HTTPError as e:
+            if cached and e.code == 304:
+                # Not modified - serve our copy and reset its ttl
+                self.cache.count("revalidated")
+                self.cache.touch(url,cached[0])
+                return cached[1]
+            response = None
+        except Exception as e:
+            response = None
+        if response is None:
+            if cached:
+                # Couldn't reach the server - an old answer beats none
+                self.cache.count("stale")
+                return cached[1]
+            return None
+        self.cache.count("misses")
+        body = self.get_bytes(url,progress,headers,expand_gzip,response=response)
+        if body is not None:
+            self.cache.save(url,response.headers,body)
+        return body
+
+    def _extend(self, buf, data):
+        # Grow buf by data - counting each time the buffer had to be
+        # reallocated, which may copy everything in it so far
+        allocated = buf.__alloc__() if hasattr(buf,"__alloc__") else None
+        size = len(buf)
+        buf.extend(data)
+        if size and allocated is not None and buf.__alloc__() != allocated:
+            self.count("buffer_copies")
+            self.count("bytes_copied",size)
+
+    def get_bytes(self, url, progress = True, headers = None, expand_gzip = True, response = None):
+        # Returns the body as a bytearray - an already opened response can be
+        # passed to skip opening the url
+        response = response or self.open_url(url, headers)
         if response is None: return None
         try: total_size = int(response.headers['Content-Length'])
         except: total_size = -1
-        chunk_so_far = b""
-        packets = queue = process = None
-        if progress:
-            # Make sure our vars are initialized
-            packets = [] if progress else None
-            queue = multiprocessing.Queue()
-            # Create the multiprocess and start it
-            process = multiprocessing.Process(
-                target=_process_hook,
-                args=(queue,total_size)
-            )
-            process.daemon = True
-            # Filthy hack for earlier python versions on Windows
-            if os.name == "nt" and hasattr(multiprocessing,"forking"):
-                self._update_main_name()
-            process.start()
+        gzipped = expand_gzip and response.headers.get("Content-Encoding","unknown").lower() == "gzip"
+        # Expand gzip data incrementally as it arrives rather than buffering
+        # the compressed body and decompressing it all at the end
+        decomp = zlib.decompressobj(16+zlib.MAX_WBITS) if gzipped else None
+        # If we know the final size, read straight into a preallocated buffer -
+        # otherwise grow a bytearray in place.  Either way we avoid copying
+        # everything read so far on each chunk.
+        direct = total_size > 0 and not gzipped and hasattr(response,"readinto")
+        buf = bytearray(total_size if direct else 0)
+        view = memoryview(buf) if direct else None
+        bytes_so_far = 0
+        reporter = self._get_reporter(progress, total_size)
         try:
             while True:
-                chunk = response.read(self.chunk)
-                if progress:
-                    # Add our items to the queue
-                    queue.put((time.time(),len(chunk)))
-                if not chunk: break
-                chunk_so_far += chunk
+                if view is not None:
+                    read = 0 if bytes_so_far >= total_size else \
+                        response.readinto(view[bytes_so_far:bytes_so_far+self.chunk])
+                else:
+                    chunk = response.read(self.chunk)
+                    read = len(chunk)
+                    if chunk and decomp:
+                        # Cap how much each call expands so a highly compressed
+                        # chunk never sits in memory twice at full size
+                        while chunk:
+                            self._extend(buf,decomp.decompress(chunk,self.chunk))
+                            chunk = decomp.unconsumed_tail
+                    elif chunk:
+                        self._extend(buf,chunk)
+                reporter.update(read)
+                if not read: break
+                bytes_so_far += read
         finally:
+            self.count("bytes",bytes_so_far)
             # Close the response whenever we're done
             response.close()
-        if expand_gzip and response.headers.get("Content-Encoding","unknown").lower() == "gzip":
-            fileobj = BytesIO(chunk_so_far)
-            gfile   = gzip.GzipFile(fileobj=fileobj)
-            return gfile.read()
-        if progress:
-            # Finalize the queue and wait
-            queue.put("DONE")
-            process.join()
-        return chunk_so_far
-
-    def stream_to_file(self, url, file_path, progress = True, headers = None, ensure_size_if_present = True, allow_resume = False):
+            if view is not None and hasattr(view,"release"):
+                # Release the buffer so it can be resized if needed
+                view.release()
+            reporter.finish()
+        if view is not None and bytes_so_far < total_size:
+            # We came up short - drop the unused tail
+            del buf[bytes_so_far:]
+        if decomp:
+            self._extend(buf,decomp.flush())
+        # Hand back the buffer itself - converting to bytes would copy it all
+        # once more
+        return buf
+
+    def _probe_ranges(self, url, headers = None):
+        # Ask for the first byte only - a 206 with a Content-Range tells us
+        # the server honors ranges, and the total size.  Returns a tuple of
+        # (final url after redirects, total size) - with a size of -1 if
+        # ranges are not supported.
+        probe_headers = self._get_headers(headers)
+        probe_headers["Range"] = "bytes=0-0"
+        response = self.open_url(url, probe_headers)
+        if response is None: return (url,-1)
+        try:
+            final_url = response.geturl() or url
+            assert response.getcode() == 206
+            total_size = int(response.headers["Content-Range"].split("/")[-1])
+        except:
+            return (url,-1)
+        finally:
+            response.close()
+        return (final_url,total_size)
+
+    def _stream_segment(self, url, file_path, start, end, headers, reporter, results, index):
+        # Fetch bytes start-end (inclusive) and write them at the same offset
+        # in file_path using our own file handle.  Records whether we got
+        # every byte we asked for in results[index].
+        segment_headers = self._get_headers(headers)
+        segment_headers["Range"] = "bytes={}-{}".format(start,end)
+        response = self.open_url(url, segment_headers)
+        if response is None: return
+        bytes_so_far = 0
+        try:
+            if response.getcode() != 206: return
+            with open(file_path,"r+b") as f:
+                f.seek(start)
+                while True:
+                    chunk = response.read(min(self.chunk,end-start+1-bytes_so_far))
+                    reporter.update(len(chunk))
+                    if not chunk: break
+                    f.write(chunk)
+                    bytes_so_far += len(chunk)
+        except:
+            return
+        finally:
+            self.count("bytes",bytes_so_far)
+            response.close()
+        results[index] = bytes_so_far == end-start+1
+
+    def stream_segments(self, url, file_path, segments = 4, progress = True, headers = None):
+        # Download url into file_path over several concurrent ranged
+        # requests.  Returns the file path on success, or None if the server
+        # doesn't support ranges or any segment failed - in which case the
+        # caller should fall back on a single stream.
+        url,total_size = self._probe_ranges(url, headers)
+        if total_size <= 0: return None
+        # Don't bother splitting into segments smaller than our chunk size
+        segments = max(1,min(segments,total_size//self.chunk))
+        # Preallocate the file so each segment can write at its own offset
+        with open(file_path,"wb") as f:
+            f.truncate(total_size)
+        reporter = self._get_reporter(progress, total_size)
+        size = total_size // segments
+        results = [False]*segments
+        threads = []
+        for i in range(segments):
+            start = i*size
+            end = total_size-1 if i == segments-1 else start+size-1
+            t = threading.Thread(
+                target=self._stream_segment,
+                args=(url,file_path,start,end,headers,reporter,results,i)
+            )
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        try:
+            for t in threads:
+                # Join on a timeout so KeyboardInterrupt is still honored
+                while t.is_alive():
+                    t.join(0.1)
+        finally:
+            reporter.finish()
+        if not all(results) or os.stat(file_path).st_size != total_size:
+            # The caller starts over on a single stream
+            self.count("retries")
+            return None
+        return file_path
+
+    def _hash_file(self, file_path, hasher):
+        # Feed the contents of file_path to hasher
+        with open(file_path,"rb") as f:
+            while True:
+                chunk = f.read(self.chunk)
+                if not chunk: break
+                hasher.update(chunk)
+        return hasher
+
+    def stream_to_file(self, url, file_path, progress = True, headers = None, ensure_size_if_present = True, allow_resume = False, segments = 1, hasher = None):
+        # If a hashlib object is passed as hasher, it's updated with every
+        # byte written so the caller can check the digest without having to
+        # read the file back
+        if segments > 1 and not (allow_resume and os.path.isfile(file_path)):
+            # Try a segmented download first - and fall back on a single
+            # stream if the server won't cooperate
+            if self.stream_segments(url, file_path, segments, progress, headers):
+                if hasher is not None:
+                    # Segments arrive out of order, so this needs a read pass
+                    self._hash_file(file_path, hasher)
+                return file_path
         response = self.open_url(url, headers)
         if response is None: return None
         bytes_so_far = 0
         try: total_size = int(response.headers['Content-Length'])
         except: total_size = -1
-        packets = queue = process = None
         mode = "wb"
+        resumed_from = 0
         if allow_resume and os.path.isfile(file_path) and total_size != -1:
             # File exists, we're resuming and have a target size.  Check the
             # local file size.
@@ -282,8 +779,11 @@ class Downloader:
             elif current_size < total_size:
                 response.close()
                 # File is not complete - seek to our current size
-                bytes_so_far = current_size
+                bytes_so_far = resumed_from = current_size
                 mode = "ab" # Append
+                if hasher is not None:
+                    # Account for what we already have
+                    self._hash_file(file_path, hasher)
                 # We also need to try creating a new request
                 # in order to pass our range header
                 new_headers = self._get_headers(headers)
@@ -292,37 +792,22 @@ class Downloader:
                 new_headers["Range"] = byte_string
                 response = self.open_url(url, new_headers)
                 if response is None: return None
-        if progress:
-            # Make sure our vars are initialized
-            packets = [] if progress else None
-            queue = multiprocessing.Queue()
-            # Create the multiprocess and start it
-            process = multiprocessing.Process(
-                target=_process_hook,
-                args=(queue,total_size,bytes_so_far)
-            )
-            process.daemon = True
-            # Filthy hack for earlier python versions on Windows
-            if os.name == "nt" and hasattr(multiprocessing,"forking"):
-                self._update_main_name()
-            process.start()
+        reporter = self._get_reporter(progress, total_size, bytes_so_far)
         with open(file_path,mode) as f:
             try:
                 while True:
                     chunk = response.read(self.chunk)
                     bytes_so_far += len(chunk)
-                    if progress:
-                        # Add our items to the queue
-                        queue.put((time.time(),len(chunk)))
+                    reporter.update(len(chunk))
                     if not chunk: break
                     f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
             finally:
                 # Close the response whenever we're done
                 response.close()
-        if progress:
-            # Finalize the queue and wait
-            queue.put("DONE")
-            process.join()
+                reporter.finish()
+                self.count("bytes",bytes_so_far-resumed_from)
         if ensure_size_if_present and total_size != -1:
             # We're verifying size - make sure we got what we asked for
             if bytes_so_far != total_size:
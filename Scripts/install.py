@@ -0,0 +1,127 @@
+import os, json, time
+from Scripts import store, utils
+
+STAGED_SUFFIX = ".staged"
+PREVIOUS_SUFFIX = ".previous"
+
+def _remove(path):
+    if path and os.path.exists(path):
+        try: os.remove(path)
+        except: pass
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        assert isinstance(manifest.get("files"),list)
+        return manifest
+    except:
+        return {"files":[]}
+
+def save_manifest(manifest_path, manifest):
+    try:
+        utils.atomic_write(manifest_path,json.dumps(manifest,indent=2))
+    except:
+        return False
+    return True
+
+def rollback(manifest_path):
+    # Swap every file from the last install with the one it replaced.  The
+    # files swapped out become the new "previous" set, so running this again
+    # rolls forward.  Returns a list of (dest, error) - error is None on
+    # success - or None if there's nothing to roll back.
+    manifest = load_manifest(manifest_path)
+    if not manifest["files"]:
+        return None
+    results = []
+    for entry in manifest["files"]:
+        dest = entry.get("dest")
+        previous = entry.get("previous")
+        swap = "{}.{}.swap".format(dest,os.getpid())
+        try:
+            current = os.path.isfile(dest)
+            if current:
+                utils.replace_file(dest,swap)
+            if previous and os.path.isfile(previous):
+                utils.replace_file(previous,dest)
+            if current:
+                utils.replace_file(swap,dest+PREVIOUS_SUFFIX)
+            # Files that didn't exist before the install are parked aside
+            # rather than deleted so they can be swapped back in
+            entry["previous"] = dest+PREVIOUS_SUFFIX if current else None
+            results.append((dest,None))
+        except Exception as e:
+            if os.path.isfile(swap) and not os.path.exists(dest):
+                try: utils.replace_file(swap,dest)
+                except: pass
+            results.append((dest,e))
+    manifest["time"] = time.time()
+    save_manifest(manifest_path,manifest)
+    return results
+
+class StagedInstall:
+    # Places every file of an update right next to its destination ahead of
+    # time - on the same filesystem - so activating the whole set is just a
+    # rename per file.  The files replaced are kept as <dest>.previous and
+    # recorded in a manifest so rollback() can swap them back just as fast.
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.files = [] # (staged path, dest) pairs
+
+    def stage(self, src, dest):
+        # Link (or copy) src next to dest - returns the method used
+        folder = os.path.dirname(dest)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        staged = "{}.{}{}".format(dest,os.getpid(),STAGED_SUFFIX)
+        method = store.link_or_copy(src,staged)
+        self.files.append((staged,dest))
+        return method
+
+    def get(self, dest):
+        # Returns the staged path for dest, if any
+        for staged,d in self.files:
+            if d == dest:
+                return staged
+        return None
+
+    def discard(self):
+        # Remove anything staged but not yet activated
+        for staged,dest in self.files:
+            _remove(staged)
+        self.files = []
+
+    def activate(self):
+        # Swap each staged file into place.  If any rename fails, those
+        # already swapped are put back and the error is raised - so we never
+        # leave a mismatched set behind.
+        old = load_manifest(self.manifest_path)
+        entries = []
+        try:
+            for staged,dest in self.files:
+                previous = dest+PREVIOUS_SUFFIX
+                entry = {"dest":dest,"previous":None}
+                if os.path.isfile(dest):
+                    utils.replace_file(dest,previous)
+                    entry["previous"] = previous
+                entries.append(entry)
+                utils.replace_file(staged,dest)
+        except:
+            for entry in reversed(entries):
+                try:
+                    if entry["previous"]:
+                        utils.replace_file(entry["previous"],entry["dest"])
+                    elif os.path.isfile(entry["dest"]):
+                        os.remove(entry["dest"])
+                except: pass
+            self.discard()
+            raise
+        self.files = []
+        # Backups from the prior install that weren't just replaced are stale
+        dests = [e["dest"] for e in entries]
+        for entry in old["files"]:
+            if not entry.get("dest") in dests:
+                _remove(entry.get("previous"))
+        save_manifest(self.manifest_path,{"time":time.time(),"files":entries})
+        return entries
@@ -0,0 +1,119 @@
+import os, re, json, subprocess, hashlib, threading
+
+PROFILES_FILE = "launch.json"
+# Lowercase gc names -> the flags that select them
+GC_FLAGS = {
+    "g1":["-XX:+UseG1GC"],
+    "zgc":["-XX:+UseZGC"],
+    "generational-zgc":["-XX:+UseZGC","-XX:+ZGenerational"],
+    "shenandoah":["-XX:+UseShenandoahGC"],
+    "parallel":["-XX:+UseParallelGC"],
+    "serial":["-XX:+UseSerialGC"]
+}
+CDS_DYNAMIC = 13 # First JDK with -XX:ArchiveClassesAtExit
+CDS_AUTO = 19 # First JDK with -XX:+AutoCreateSharedArchive
+
+_java_versions = {}
+_java_lock = threading.Lock()
+
+def load_profile(folder, name = None):
+    # Reads folder/launch.json and returns the named profile - or the one
+    # listed as "default".  Returns None if there's no launch.json, and
+    # raises if the file is broken or the profile doesn't exist.  Layout:
+    #
+    # {
+    #   "default": "prod",
+    #   "profiles": {
+    #     "prod": {"xms":"1G", "xmx":"4G", "gc":"zgc", "cds":true, "args":[]}
+    #   }
+    # }
+    path = os.path.join(folder,PROFILES_FILE)
+    if not os.path.isfile(path):
+        if name:
+            raise ValueError("{} not found".format(path))
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    profiles = data.get("profiles",{})
+    name = name or data.get("default") or "default"
+    if not name in profiles:
+        raise ValueError("no \"{}\" profile in {}".format(name,path))
+    profile = profiles[name]
+    gc = profile.get("gc")
+    if gc and not str(gc).lower() in GC_FLAGS:
+        raise ValueError("unknown gc \"{}\" - expected one of {}".format(gc,", ".join(sorted(GC_FLAGS))))
+    return profile
+
+def get_java_version(java_path):
+    # Returns the feature version of java_path (i.e. 8, 17, 21) - cached for
+    # as long as the binary doesn't change
+    try:
+        st = os.stat(os.path.realpath(java_path))
+    except OSError:
+        return None
+    key = (os.path.realpath(java_path),st.st_size,st.st_mtime)
+    with _java_lock:
+        if key in _java_versions:
+            return _java_versions[key]
+    version = None
+    try:
+        p = subprocess.Popen([java_path,"-version"],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        o,e = p.communicate()
+        m = re.search(r"version \"(1\.)?(\d+)",(o+e).decode("utf-8","ignore"))
+        if m:
+            version = int(m.group(2))
+    except:
+        pass
+    with _java_lock:
+        _java_versions[key] = version
+    return version
+
+def get_archive(cds_dir, jar, java_path):
+    # Archives are only valid for one build of the jar on one JVM - so name
+    # them after both.  Archives made for older builds of the same jar are
+    # removed as they can never be used again.
+    jar = os.path.realpath(jar)
+    try:
+        jar_st = os.stat(jar)
+        java_st = os.stat(os.path.realpath(java_path))
+    except OSError:
+        return None
+    prefix = hashlib.sha1(jar.encode("utf-8")).hexdigest()[:12]
+    key = hashlib.sha1(json.dumps([
+        jar_st.st_size,jar_st.st_mtime,jar_st.st_ino,
+        os.path.realpath(java_path),java_st.st_size,java_st.st_mtime
+    ]).encode("utf-8")).hexdigest()[:12]
+    archive = os.path.join(cds_dir,"{}-{}.jsa".format(prefix,key))
+    if os.path.isdir(cds_dir):
+        for name in os.listdir(cds_dir):
+            if name.startswith(prefix+"-") and name != os.path.basename(archive):
+                try: os.remove(os.path.join(cds_dir,name))
+                except: pass
+    else:
+        os.makedirs(cds_dir)
+    return archive
+
+def get_args(profile, jar, java_path, cds_dir = None):
+    # Build the JVM arguments for profile - to go between java and -jar
+    args = []
+    if not profile:
+        return args
+    if profile.get("xms"):
+        args.append("-Xms{}".format(profile["xms"]))
+    if profile.get("xmx"):
+        args.append("-Xmx{}".format(profile["xmx"]))
+    if profile.get("gc"):
+        args.extend(GC_FLAGS[str(profile["gc"]).lower()])
+    if profile.get("cds") and cds_dir:
+        version = get_java_version(java_path) or 0
+        archive = get_archive(cds_dir,jar,java_path) if version >= CDS_DYNAMIC else None
+        if archive and version >= CDS_AUTO:
+            # The JVM creates, validates and refreshes the archive itself
+            args.extend(["-XX:+AutoCreateSharedArchive","-XX:SharedArchiveFile={}".format(archive)])
+        elif archive and os.path.isfile(archive):
+            args.append("-XX:SharedArchiveFile={}".format(archive))
+        elif archive:
+            # First run of this build - dump the loaded classes when it exits
+            args.append("-XX:ArchiveClassesAtExit={}".format(archive))
+    args.extend(str(x) for x in profile.get("args",[]))
+    return args
@@ -0,0 +1,119 @@
+import os, json, time, socket
+from Scripts import utils
+
+PREFIX = "lavalink_updater"
+# Span attributes exported as Prometheus gauges - attribute -> (metric, help)
+PROM_METRICS = (
+    ("seconds","phase_seconds","Seconds spent in each phase of the last run"),
+    ("bytes","phase_bytes","Bytes transferred during each phase of the last run"),
+    ("throughput","phase_throughput_bytes_per_second","Average transfer rate of each phase of the last run"),
+    ("retries","phase_retries","Requests retried during each phase of the last run"),
+    ("cache_hits","phase_cache_hits","HTTP cache and artifact store hits during each phase of the last run")
+)
+
+class Spans(list):
+    # A list of (name, start, end, attributes) tuples, one per phase.  If
+    # counters is passed it's called for a dict of running totals (i.e.
+    # bytes, retries) each time a span is added, and the change since the
+    # last span is recorded with it - so every phase reports only what
+    # happened while it ran.
+
+    def __init__(self, counters = None, show = True, json_path = None, prom_path = None):
+        list.__init__(self)
+        self.counters = counters
+        self.show = show # Print the timings for people as well
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.run = "{}-{}".format(int(time.time()*1000),os.getpid())
+        self.last = counters() if counters else {}
+
+    def add(self, name, start, end, **attrs):
+        if self.counters:
+            now = self.counters()
+            for key,value in now.items():
+                attrs.setdefault(key,value-self.last.get(key,0))
+            self.last = now
+        if attrs.get("bytes") and end > start:
+            attrs.setdefault("throughput",attrs["bytes"]/(end-start))
+        self.append((name,start,end,attrs))
+        return end
+
+    def add_concurrent(self, name, start, end, **attrs):
+        # For work that overlapped other spans - the counters stay with them
+        self.append((name,start,end,attrs))
+        return end
+
+def get_outage(spans):
+    # Lavalink is unavailable from the moment we start stopping it until it
+    # answers again - or until the new process is spawned if we didn't wait
+    # for it.  Returns (seconds, ready) or (None, False) if it wasn't stopped.
+    stops = [start for name,start,end,attrs in spans if name == "stop"]
+    launches = [end for name,start,end,attrs in spans if name == "launch"]
+    ready = [end for name,start,end,attrs in spans if name == "ready"]
+    if stops and ready:
+        return (ready[-1]-stops[0],True)
+    if stops and launches:
+        return (launches[-1]-stops[0],False)
+    return (None,False)
+
+def to_records(spans):
+    # Returns a dict per span, followed by one summing up the run
+    host = socket.gethostname()
+    records = []
+    for name,start,end,attrs in spans:
+        record = {"event":"phase","run":spans.run,"host":host,"phase":name,"start":round(start,6),"seconds":round(end-start,6)}
+        for key,value in attrs.items():
+            record[key] = round(value,3) if isinstance(value,float) else value
+        records.append(record)
+    if spans:
+        outage,ready = get_outage(spans)
+        records.append({
+            "event":"run",
+            "run":spans.run,
+            "host":host,
+            "start":round(min(s[1] for s in spans),6),
+            "seconds":round(max(s[2] for s in spans)-min(s[1] for s in spans),6),
+            "outage_seconds":None if outage is None else round(outage,6),
+            "outage_until":"ready" if ready else "launch"
+        })
+    return records
+
+def write_json_lines(path, spans):
+    # Append one JSON object per line so runs accumulate in a single file
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path,"a") as f:
+        for record in to_records(spans):
+            f.write(json.dumps(record,sort_keys=True)+"\n")
+    return path
+
+def _escape(value):
+    return str(value).replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
+
+def to_prometheus(spans):
+    # Render the last run in the Prometheus text exposition format
+    out = []
+    for attr,metric,help_text in PROM_METRICS:
+        samples = [(name,end-start if attr == "seconds" else attrs.get(attr)) for name,start,end,attrs in spans]
+        samples = [(name,value) for name,value in samples if value is not None]
+        if not samples:
+            continue
+        out.append("# HELP {}_{} {}".format(PREFIX,metric,help_text))
+        out.append("# TYPE {}_{} gauge".format(PREFIX,metric))
+        for name,value in samples:
+            out.append("{}_{}{{phase=\"{}\"}} {}".format(PREFIX,metric,_escape(name),float(value)))
+    outage,ready = get_outage(spans)
+    if outage is not None:
+        out.append("# HELP {}_outage_seconds Seconds Lavalink was down during the last run".format(PREFIX))
+        out.append("# TYPE {}_outage_seconds gauge".format(PREFIX))
+        out.append("{}_outage_seconds{{until=\"{}\"}} {}".format(PREFIX,"ready" if ready else "launch",float(outage)))
+    out.append("# HELP {}_last_run_timestamp_seconds When the last run finished".format(PREFIX))
+    out.append("# TYPE {}_last_run_timestamp_seconds gauge".format(PREFIX))
+    out.append("{}_last_run_timestamp_seconds {}".format(PREFIX,float(spans[-1][2] if spans else time.time())))
+    return "\n".join(out)+"\n"
+
+def write_prometheus(path, spans):
+    # The textfile collector may read at any time - so write to a temp file
+    # and swap it into place
+    return utils.atomic_write(path,to_prometheus(spans))
@@ -0,0 +1,67 @@
+import socket, time
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+PROBE_TIMEOUT = 2 # Max seconds for any single connection attempt
+
+def probe_host(address):
+    # Wildcard binds aren't something we can connect to - use loopback
+    if not address or address in ("0.0.0.0","*"):
+        return "127.0.0.1"
+    if address in ("::","[::]"):
+        return "::1"
+    return address.strip("[]")
+
+def check_http(host, port, path = "/version", headers = None, timeout = PROBE_TIMEOUT):
+    # GET path and return (ready, detail).  Any response short of a server
+    # error means Lavalink is up and handling requests - a 401 just means the
+    # password didn't match.
+    conn = HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read(256)
+        if response.status >= 500:
+            return (False,"HTTP {}".format(response.status))
+        if response.status == 200:
+            return (True,body.decode("utf-8","ignore").strip() or "HTTP 200")
+        return (True,"HTTP {}".format(response.status))
+    except Exception as e:
+        return (False,str(e) or type(e).__name__)
+    finally:
+        conn.close()
+
+def check_tcp(host, port, timeout = PROBE_TIMEOUT):
+    # Just see if something accepts connections on the port
+    try:
+        s = socket.create_connection((host,port),timeout)
+        s.close()
+        return (True,"port {} open".format(port))
+    except Exception as e:
+        return (False,str(e) or type(e).__name__)
+
+def wait_ready(host, port, deadline, path = "/version", headers = None, is_alive = None, initial_delay = 0.1, max_delay = 1):
+    # Poll host:port with an exponential backoff until it's healthy, deadline
+    # seconds pass, or is_alive() reports the process went away.  Passing a
+    # path of None checks with a plain TCP connect.  Returns (ready, elapsed,
+    # detail) where detail is the last response or error.
+    start = time.time()
+    delay = initial_delay
+    detail = None
+    while True:
+        if is_alive and not is_alive():
+            return (False,time.time()-start,"process exited")
+        timeout = min(PROBE_TIMEOUT,max(0.1,deadline-(time.time()-start)))
+        if path:
+            ready,detail = check_http(host,port,path=path,headers=headers,timeout=timeout)
+        else:
+            ready,detail = check_tcp(host,port,timeout=timeout)
+        elapsed = time.time()-start
+        if ready:
+            return (True,elapsed,detail)
+        if elapsed >= deadline:
+            return (False,elapsed,detail)
+        time.sleep(min(delay,deadline-elapsed))
+        delay = min(delay*2,max_delay)
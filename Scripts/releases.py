@@ -0,0 +1,197 @@
+import os, re, json, time
+from Scripts import utils
+
+PER_PAGE = 100 # Most releases GitHub returns per page
+CONSTRAINT_REG = re.compile(r"^\s*(?P<op>>=|<=|==|!=|>|<|=|~|\^)?\s*v?(?P<version>[0-9a-z.*+_-]+)\s*$",re.I)
+WILDCARDS = ("x","*")
+
+def is_constraint(text):
+    # Exact tags are left to GitHub - only ranges and wildcards (i.e. 4.x,
+    # ^4.0, >=1.8,<2) are resolved locally
+    text = str(text or "").strip().lower()
+    if not text:
+        return False
+    if text in WILDCARDS or any(c in text for c in "<>=!~^,"):
+        return True
+    return any(part in WILDCARDS for part in text.split("."))
+
+def _bump(parts, index):
+    # Returns the version just past parts[:index+1] - i.e. 1.8 -> 1.9
+    parts = [int(p) if p.isdigit() else 0 for p in parts[:index+1]]
+    parts[-1] += 1
+    return utils.version_key(".".join(str(p) for p in parts))
+
+def parse_constraint(text):
+    # Turns a comma separated set of comparisons into a list of
+    # (operator, VersionKey) pairs that must all hold.  Supports:
+    #
+    # - comparisons: >=1.8, <2, >4.0.0, <=4.0.8, ==4.0.8, !=4.0.5
+    # - wildcards: 4.x, 4.0.*, * (any release)
+    # - tilde: ~1.8 is >=1.8,<1.9 and ~1 is >=1,<2
+    # - caret: ^4.0 is >=4.0,<5 and ^0.3 is >=0.3,<0.4
+    #
+    # Raises ValueError if any part can't be parsed.
+    comparisons = []
+    for part in str(text).split(","):
+        if not part.strip():
+            continue
+        match = CONSTRAINT_REG.match(part)
+        if not match:
+            raise ValueError("invalid version constraint: {}".format(part.strip()))
+        op = match.group("op") or "=="
+        version = match.group("version").lower()
+        parts = version.split(".")
+        if any(p in WILDCARDS for p in parts):
+            # Everything after the first wildcard is ignored
+            fixed = parts[:[p in WILDCARDS for p in parts].index(True)]
+            if not op in ("==","="):
+                raise ValueError("wildcards can't be combined with {}: {}".format(op,part.strip()))
+            if fixed:
+                comparisons.append((">=",utils.version_key(".".join(fixed))))
+                comparisons.append(("<",_bump(fixed,len(fixed)-1)))
+            continue
+        key = utils.version_key(version)
+        if op == "~":
+            comparisons.append((">=",key))
+            comparisons.append(("<",_bump(parts,min(1,len(parts)-1))))
+        elif op == "^":
+            # Bump the first non-zero part
+            index = next((i for i,p in enumerate(parts) if p.isdigit() and int(p)),len(parts)-1)
+            comparisons.append((">=",key))
+            comparisons.append(("<",_bump(parts,index)))
+        else:
+            comparisons.append(("==" if op == "=" else op,key))
+    if not comparisons and not str(text).strip() in WILDCARDS:
+        raise ValueError("invalid version constraint: {}".format(text))
+    return comparisons
+
+def matches(version, comparisons):
+    key = utils.version_key(version)
+    for op,bound in comparisons:
+        if op == ">=" and not key >= bound: return False
+        if op == ">" and not key > bound: return False
+        if op == "<=" and not key <= bound: return False
+        if op == "<" and not key < bound: return False
+        if op == "==" and not key == bound: return False
+        if op == "!=" and key == bound: return False
+    return True
+
+def newest(versions, constraint, prerelease = None):
+    # Returns the highest version that satisfies constraint.  Pre-releases
+    # are only considered if the constraint names one itself (i.e.
+    # >=4.0.0-beta.1) - prerelease can be a function reporting whether a
+    # version is one beyond what its tag says (i.e. GitHub's flag).
+    comparisons = parse_constraint(constraint)
+    allow_pre = any(bound.prerelease for op,bound in comparisons)
+    best = None
+    for version in versions:
+        if not allow_pre and (utils.version_key(version).prerelease or (prerelease and prerelease(version))):
+            continue
+        if not matches(version,comparisons):
+            continue
+        if best is None or utils.version_key(version) > utils.version_key(best):
+            best = version
+    return best
+
+class ReleaseIndex:
+    # On-disk index of a GitHub repo's releases - tag -> published date,
+    # pre-release flag and [name, url, digest] for each asset.  It's filled
+    # by paging through api.github.com/repos/OWNER/REPO/releases once, and
+    # after that only the pages newer than the last release we've seen are
+    # fetched - and not at all while the index is younger than ttl seconds.
+
+    def __init__(self, path, url, ttl = 0):
+        self.path = path
+        self.url = url # i.e. https://api.github.com/repos/OWNER/REPO/releases
+        self.ttl = ttl
+        self.releases = {}
+        self.synced = 0
+        self.complete = False # Whether we've paged all the way back once
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            assert data.get("url") == self.url
+            self.releases = data["releases"]
+            self.synced = data.get("synced",0)
+            self.complete = data.get("complete",False)
+        except:
+            self.releases = {}
+            self.synced = 0
+            self.complete = False
+
+    def save(self):
+        try:
+            utils.atomic_write(self.path,json.dumps({
+                "url":self.url,
+                "synced":self.synced,
+                "complete":self.complete,
+                "releases":self.releases
+            },separators=(",",":")))
+        except:
+            return False
+        return True
+
+    def is_fresh(self):
+        return self.complete and self.ttl > 0 and time.time()-self.synced < self.ttl
+
+    def sync(self, fetch, force = False):
+        # Page through the releases newest first until we reach one we
+        # already have - fetch(url) returns the response body or None.
+        # Returns True if the network was consulted, and raises if the
+        # first page couldn't be fetched.
+        if not force and self.is_fresh():
+            return False
+        found = {}
+        page = 1
+        reached_end = False
+        while True:
+            body = fetch("{}?per_page={}&page={}".format(self.url,PER_PAGE,page))
+            if body is None:
+                if page == 1:
+                    raise Exception("Could not fetch {}".format(self.url))
+                break # Keep what we got - the next sync picks up the rest
+            items = json.loads(body)
+            known = False
+            for release in items:
+                tag = release.get("tag_name")
+                if not tag or release.get("draft"):
+                    continue
+                known = known or tag in self.releases
+                found[tag] = {
+                    "published":release.get("published_at"),
+                    "prerelease":bool(release.get("prerelease")),
+                    "assets":[[
+                        a.get("name"),
+                        a.get("browser_download_url"),
+                        a.get("digest")
+                    ] for a in release.get("assets",[]) if a.get("browser_download_url")]
+                }
+            if len(items) < PER_PAGE:
+                reached_end = True
+                break
+            if known and self.complete:
+                # Everything past here is already indexed
+                reached_end = True
+                break
+            page += 1
+        self.releases.update(found)
+        self.complete = self.complete or reached_end
+        self.synced = time.time()
+        self.save()
+        return True
+
+    def find(self, constraint, regex_search = None):
+        # Returns (tag, [name, url, digest]) for the newest release matching
+        # constraint that has an asset matching regex_search - or None
+        candidates = [
+            tag for tag,release in self.releases.items()
+            if any(regex_search is None or regex_search.match(a[0] or "") for a in release["assets"])
+        ]
+        tag = newest(candidates,constraint,prerelease=lambda t:self.releases[t].get("prerelease"))
+        if tag is None:
+            return None
+        asset = next(a for a in self.releases[tag]["assets"] if regex_search is None or regex_search.match(a[0] or ""))
+        return (tag,asset)
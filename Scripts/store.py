@@ -0,0 +1,248 @@
+import os, json, hashlib, shutil, threading, time
+from Scripts import utils
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows - we just won't attempt reflinks
+    fcntl = None
+
+FICLONE = 0x40049409 # Linux ioctl to share extents between files (reflink)
+
+def get_sha256(file_path, chunk = 1048576):
+    sha = hashlib.sha256()
+    with open(file_path,"rb") as f:
+        while True:
+            data = f.read(chunk)
+            if not data: break
+            sha.update(data)
+    return sha.hexdigest()
+
+def normalize_digest(digest):
+    # Accepts either a bare hex digest or GitHub's "sha256:<hex>" form and
+    # returns the lowercase hex - or None if it isn't a sha256 digest
+    if not digest:
+        return None
+    digest = str(digest).strip().lower()
+    if ":" in digest:
+        algo,digest = digest.split(":",1)
+        if algo != "sha256":
+            return None
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        return None
+    return digest
+
+def reflink(src, dest):
+    # Attempt a copy-on-write clone of src at dest - returns True on success
+    if fcntl is None:
+        return False
+    try:
+        with open(src,"rb") as s, open(dest,"wb") as d:
+            fcntl.ioctl(d.fileno(),FICLONE,s.fileno())
+    except:
+        if os.path.exists(dest):
+            try: os.remove(dest)
+            except: pass
+        return False
+    return True
+
+def link_or_copy(src, dest):
+    # Places src at dest as cheaply as possible - a hardlink, then a reflink,
+    # then a full copy.  Returns the method used.
+    if os.path.exists(dest):
+        os.remove(dest)
+    if hasattr(os,"link"):
+        try:
+            os.link(src,dest)
+            return "hardlink"
+        except OSError:
+            pass
+    if reflink(src,dest):
+        return "reflink"
+    shutil.copy2(src,dest)
+    return "copy"
+
+def asset_key(url):
+    # Turns a GitHub release asset url into an OWNER/REPO/TAG/ASSET key - any
+    # other url is used as-is
+    try:
+        base,rest = url.split("/releases/download/",1)
+        owner,repo = base.rstrip("/").split("/")[-2:]
+        tag,asset = rest.split("/",1)
+        return "/".join((owner,repo,tag,asset))
+    except:
+        return url
+
+class ArtifactStore:
+    # Content-addressed file store laid out as root/sha256/ab/abcdef... with
+    # an index mapping keys (OWNER/REPO/TAG/ASSET via asset_key()) to digests
+    # so we can recognize an artifact we've already fetched.  The index also
+    # tracks when each key was last used so the store can be trimmed back to
+    # a maximum size, least recently used first.
+
+    def __init__(self, root, max_size = 0):
+        self.root = root
+        self.max_size = max_size # 0 = unbounded
+        self.index_path = os.path.join(root,"index.json")
+        self.lock = threading.Lock()
+        self.stats = {"hits":0} # Artifacts placed from the store
+
+    def path(self, digest):
+        digest = normalize_digest(digest)
+        if not digest: return None
+        return os.path.join(self.root,"sha256",digest[:2],digest)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except:
+            return {}
+        # Normalize any bare digest entries
+        for key in index:
+            if not isinstance(index[key],dict):
+                index[key] = {"digest":index[key],"last_used":0}
+        return index
+
+    def _save_index(self, index):
+        try:
+            utils.atomic_write(self.index_path,json.dumps(index,indent=2))
+        except:
+            return False
+        return True
+
+    def _touch(self, key):
+        with self.lock:
+            index = self._load_index()
+            if key in index:
+                index[key]["last_used"] = time.time()
+                self._save_index(index)
+
+    def lookup(self, key):
+        # Returns the digest last stored under key, if any
+        with self.lock:
+            entry = self._load_index().get(key)
+        return entry.get("digest") if entry else None
+
+    def find(self, prefix, regex_search = None):
+        # Returns a list of (key, entry) pairs whose key starts with prefix
+        # and whose asset name matches regex_search, if passed - most
+        # recently used first
+        with self.lock:
+            index = self._load_index()
+        matches = []
+        for key,entry in index.items():
+            if not key.startswith(prefix):
+                continue
+            if regex_search and not regex_search.match(key.split("/")[-1]):
+                continue
+            matches.append((key,entry))
+        return sorted(matches,key=lambda x:x[1].get("last_used",0),reverse=True)
+
+    def get(self, digest, verify = True):
+        # Returns the path to the stored artifact, or None if we don't have
+        # it.  When verifying, a stored file whose contents no longer match
+        # its digest is discarded.
+        path = self.path(digest)
+        if not path or not os.path.isfile(path):
+            return None
+        if verify and get_sha256(path) != normalize_digest(digest):
+            try: os.remove(path)
+            except: pass
+            return None
+        return path
+
+    def add(self, file_path, digest, key = None, url = None):
+        # Links (or copies) file_path into the store under digest, and
+        # optionally records key -> digest.  Returns the stored path.
+        path = self.path(digest)
+        if not path: return None
+        if not os.path.isfile(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # Place it under a temp name first so a partial copy is never
+            # mistaken for the real thing
+            temp_path = "{}.{}.tmp".format(path,os.getpid())
+            link_or_copy(file_path,temp_path)
+            utils.replace_file(temp_path,path)
+        if key:
+            with self.lock:
+                index = self._load_index()
+                index[key] = {
+                    "digest":normalize_digest(digest),
+                    "url":url,
+                    "size":os.stat(path).st_size,
+                    "last_used":time.time()
+                }
+                self._save_index(index)
+        return path
+
+    def link(self, digest, dest, key = None):
+        # Place the stored artifact at dest - returns the method used, or
+        # None if we don't have it
+        path = self.get(digest, verify=False)
+        if not path: return None
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        method = link_or_copy(path,dest)
+        with self.lock:
+            self.stats["hits"] += 1
+        if key:
+            self._touch(key)
+        return method
+
+    def size(self):
+        # Returns the total size of every stored artifact
+        total = 0
+        for path,digest in self._stored():
+            try: total += os.stat(path).st_size
+            except: pass
+        return total
+
+    def _stored(self):
+        # Yields (path, digest) for each file in the store
+        folder = os.path.join(self.root,"sha256")
+        if not os.path.isdir(folder):
+            return
+        for sub in os.listdir(folder):
+            sub_path = os.path.join(folder,sub)
+            if not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                if normalize_digest(name):
+                    yield (os.path.join(sub_path,name),name)
+
+    def evict(self, max_size = None):
+        # Remove least recently used artifacts until the store fits within
+        # max_size bytes.  Returns a list of the digests removed.
+        max_size = self.max_size if max_size is None else max_size
+        if not max_size or max_size <= 0:
+            return []
+        removed = []
+        with self.lock:
+            index = self._load_index()
+            # A digest was last used whenever any key pointing at it was
+            last_used = {}
+            for key,entry in index.items():
+                d = entry.get("digest")
+                last_used[d] = max(last_used.get(d,0),entry.get("last_used",0))
+            stored = []
+            total = 0
+            for path,digest in self._stored():
+                try: size = os.stat(path).st_size
+                except: continue
+                total += size
+                # Files missing from the index are evicted first
+                stored.append((last_used.get(digest,-1),path,digest,size))
+            for used,path,digest,size in sorted(stored):
+                if total <= max_size:
+                    break
+                try: os.remove(path)
+                except: continue
+                total -= size
+                removed.append(digest)
+            if removed:
+                for key in [k for k in index if index[k].get("digest") in removed]:
+                    del index[key]
+                self._save_index(index)
+        return removed
@@ -1,4 +1,5 @@
-import sys, os, time, re, json, datetime, ctypes, subprocess
+import sys, os, time, re, json, datetime, ctypes, subprocess, threading
+from collections import OrderedDict
 
 if os.name == "nt":
     # Windows
@@ -7,6 +8,92 @@ else:
     # Not Windows \o/
     import select
 
+def replace_file(src, dest):
+    # Rename src over dest - os.replace() isn't available on Python 2
+    getattr(os,"replace",os.rename)(src,dest)
+
+def atomic_write(path, data, mode = None):
+    # Write data to a temp file beside path and swap it into place so
+    # readers only ever see the old or the new contents.  The temp name is
+    # unique per process and thread, and is removed if anything fails before
+    # the error is raised.  Bytes are written in binary mode unless a mode
+    # is passed.  Returns path.
+    if mode is None:
+        mode = "wb" if isinstance(data,(bytes,bytearray)) and not isinstance(data,str) else "w"
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    temp_path = "{}.{}.{}.tmp".format(path,os.getpid(),threading.current_thread().ident)
+    try:
+        with open(temp_path,mode) as f:
+            f.write(data)
+        replace_file(temp_path,path)
+    except:
+        if os.path.exists(temp_path):
+            try: os.remove(temp_path)
+            except: pass
+        raise
+    return path
+
+VERSION_CACHE_SIZE = 4096 # Parsed version strings to keep around
+VERSION_REG = re.compile(r"\d+|[a-z]+")
+
+class VersionKey(tuple):
+    # Sortable key for a version string - (release, stable, pre-release) where
+    # release and pre-release are tuples of (0, number) or (1, text) pieces.
+    # Handles semver and the looser tags seen in the wild:
+    #
+    # - a leading "v" is dropped and case is ignored
+    # - build metadata after "+" doesn't affect ordering
+    # - trailing zeros don't count, so 4.0 == 4.0.0
+    # - a pre-release sorts before its release (4.0.0-beta.5 < 4.0.0), and
+    #   numbers within it compare numerically (rc.2 < rc.10, rc2 < rc10)
+
+    def __new__(cls, version):
+        text = str(version).strip().lower()
+        if len(text) > 1 and text[0] == "v" and text[1].isdigit():
+            text = text[1:]
+        text,_,build = text.partition("+")
+        release,sep,pre = text.partition("-")
+        release = cls._parse(release)
+        while release and release[-1] == (0,0):
+            release = release[:-1]
+        key = tuple.__new__(cls,(release,0 if sep else 1,cls._parse(pre)))
+        key.text = str(version)
+        key.build = build or None
+        return key
+
+    @staticmethod
+    def _parse(text):
+        return tuple((0,int(x)) if x.isdigit() else (1,x) for x in VERSION_REG.findall(text))
+
+    @property
+    def prerelease(self):
+        return not self[1]
+
+    def __repr__(self):
+        return "VersionKey({!r})".format(self.text)
+
+_version_keys = OrderedDict()
+_version_lock = threading.Lock()
+
+def version_key(version):
+    # Returns the VersionKey for version - memoized, least recently used
+    # strings are dropped once VERSION_CACHE_SIZE are cached.  Usable as a
+    # sort key, i.e. sorted(tags, key=version_key).
+    version = str(version)
+    with _version_lock:
+        key = _version_keys.pop(version,None)
+        if key is not None:
+            _version_keys[version] = key
+            return key
+    key = VersionKey(version)
+    with _version_lock:
+        _version_keys[version] = key
+        while len(_version_keys) > VERSION_CACHE_SIZE:
+            _version_keys.popitem(last=False)
+    return key
+
 class Utils:
 
     def __init__(self, name = "Python Script"):
@@ -54,6 +141,14 @@ class Utils:
         sep = str(kwargs.get("separator", "."))
 
         ignore_case = kwargs.get("ignore_case", True)
+
+        if sep == "." and ignore_case:
+            # Compare cached semver-aware keys - custom separators and case
+            # sensitive checks fall through to the segment by segment logic
+            key1, key2 = version_key(vers1), version_key(vers2)
+            if key1 == key2:
+                return None
+            return key1 < key2
         
         # Cast as strings
         vers1 = str(vers1)